@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# stdlib
+import random
+
+# our stuff
+from kpopcharts import kpopcharts
+from kpopcharts import transport
+
+_title_letters = 'abcdefghijklmnopqrstuvwxyz     '
+_artist_letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_korean_letters = '가나다라마바사아자차카타파하소녀시대방탄소년단트와이스'
+
+class FixtureTransport():
+    def __init__(self, page):
+        self._page = page
+
+    def get(self, url, headers=None, timeout=None, retries=0, deadline=None, hedge=None):
+        return transport.Response(url, self._page, True)
+
+class SyntheticChart(list):
+    def __init__(self, name, entries):
+        super(SyntheticChart, self).__init__(entries)
+        self.name = name
+        self.chart_type = kpopcharts.ChartType.Week
+        self.limit = len(entries)
+        self.url = ''
+
+def _word(rnd, letters, low, high):
+    return ''.join(rnd.choice(letters) for i in range(rnd.randint(low, high))).strip() or letters[0]
+
+def songs(count, seed=0):
+    rnd = random.Random(seed)
+    result = list()
+
+    for i in range(count):
+        change = rnd.choice(('up', 'down', 'new', 'none'))
+        result.append(dict(title=_word(rnd, _title_letters, 4, 20),
+                           artist=_word(rnd, _artist_letters, 2, 10),
+                           korean=_word(rnd, _korean_letters, 2, 5),
+                           change=change,
+                           diff=rnd.randint(1, 20) if change in ('up', 'down') else 0,
+                           video='V{0:09d}'.format(i)))
+
+    return result
+
+def _noise(rnd):
+    return '<div class="info"><span class="icon">*</span><p>-</p></div>' * rnd.randint(1, 4)
+
+# The pages below are synthetic: just enough markup, plus some noise, for the
+# parsers' XPath expressions to find. No recorded pages from the sites ship
+# with the benchmarks; see --record and --pages in benchmarks.run.
+def ichart_page(count, seed=0):
+    rnd = random.Random(seed)
+    arrows = dict(up='arrow1', down='arrow2', none='arrow3', new='arrow4')
+    rows = list()
+
+    for i, song in enumerate(songs(count, seed)):
+        diff = song['diff'] or ''
+        rows.append('<tr><td class="ichart_score{0}_change"><span class="arrow {1}"></span>{2}</td>{3}'
+                    '<td class="ichart_score{0}_song1">{4}</td>'
+                    '<td class="ichart_score{0}_artist1">{5} &amp; {6}</td>'
+                    '<td class="ichart_mv"><a href="javascript:mv(1,\'{7}\')">MV</a></td></tr>'.format(
+                    i, arrows[song['change']], diff, _noise(rnd), song['title'], song['artist'],
+                    song['korean'], song['video']))
+
+    return '<html><body>{0}<table>{1}</table>{0}</body></html>'.format(_noise(rnd), ''.join(rows)).encode('utf-8')
+
+def melon_page(count, seed=0):
+    rnd = random.Random(seed)
+    rows = list()
+
+    for song in songs(count, seed):
+        change = 'static' if song['change'] == 'none' else song['change']
+        rows.append('<tr><td><span class="rank_wrap"><span class="icon_rank_{0}"></span><span>{1}</span></span></td>{2}'
+                    '<td><div class="ellipsis rank01"><span><a>{3}</a></span></div>'
+                    '<div class="ellipsis rank02"><a>{4} ({5})</a><span>|{4}</span></div></td></tr>'.format(
+                    change, song['diff'], _noise(rnd), song['title'], song['korean'], song['artist']))
+
+    return '<html><body><table>{0}</table></body></html>'.format(''.join(rows)).encode('utf-8')
+
+def gaon_page(count, seed=0):
+    rnd = random.Random(seed)
+    rows = list()
+
+    for rank, song in enumerate(songs(count, seed), 1):
+        change = '' if song['change'] == 'none' else song['change']
+        rows.append('<tr><td class="ranking">{0}</td><td class="change"><span class="{1}">{2}</span></td>{3}'
+                    '<td class="subject"><p>{4}</p><p>{5} | Album</p></td></tr>'.format(
+                    rank, change, song['diff'], _noise(rnd), song['title'], song['korean']))
+
+    return '<html><body><table>{0}</table></body></html>'.format(''.join(rows)).encode('utf-8')
+
+pages = dict(ichart=(kpopcharts.IChart, ichart_page),
+             melon=(kpopcharts.MelonChart, melon_page),
+             gaon=(kpopcharts.GaonChart, gaon_page))
+
+def synthetic_charts(entries, charts, seed=0):
+    # Every chart draws from the same pool of songs, written the way the
+    # different sources write them: Korean or English artist names, featuring
+    # credits in the title and slightly different spellings.
+    rnd = random.Random(seed)
+    pool = songs(entries * 2, seed)
+    result = list()
+
+    for i in range(charts):
+        chart_entries = list()
+
+        for rank, song in enumerate(rnd.sample(pool, entries), 1):
+            entry = kpopcharts.ChartEntry()
+            entry.rank = rank
+            entry.change = song['change']
+            entry.change_diff = song['diff']
+            entry.title = song['title']
+
+            variant = rnd.random()
+
+            if variant < 0.2:
+                entry.title += ' (Feat. {0})'.format(song['artist'])
+            elif variant < 0.3:
+                entry.title += 'e'
+
+            variant = rnd.random()
+
+            if variant < 0.4:
+                names = [song['artist']]
+            elif variant < 0.6:
+                names = [song['korean']]
+            elif variant < 0.8:
+                names = ['{0} ({1})'.format(song['korean'], song['artist'])]
+            else:
+                names = [song['artist'], song['korean']]
+
+            for name in names:
+                entry.artists.append(kpopcharts.Artist(name))
+
+            if i == 0 or rnd.random() < 0.5:
+                entry.video = 'https://youtu.be/' + song['video']
+
+            chart_entries.append(entry)
+
+        result.append(SyntheticChart('Chart {0}'.format(i + 1), chart_entries))
+
+    return result
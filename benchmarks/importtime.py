@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# stdlib
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+# our stuff
+from . import run
+
+modules = ['kpopcharts.kpopcharts', 'kpopcharts.youtube', 'kpopcharts.transport', 'kpopcharts.archive']
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def importtime(module):
+    # Each sample is a fresh interpreter so nothing is already in
+    # sys.modules; -X importtime reports microseconds per import.
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+        cwd=root, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+    imports = list()
+
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own), int(cumulative)))
+
+    return imports
+
+def measure(module, repeat):
+    samples = [importtime(module) for i in range(repeat)]
+    totals = [dict((name, cumulative) for name, own, cumulative in imports)[module] / 1e6 for imports in samples]
+
+    # The slowest imports of the fastest sample, by their own time.
+    best = samples[totals.index(min(totals))]
+    heaviest = sorted(best, key=lambda item: item[1], reverse=True)
+
+    return dict(min=min(totals), median=statistics.median(totals),
+                heaviest=[dict(module=name, own=own / 1e6, cumulative=cumulative / 1e6)
+                          for name, own, cumulative in heaviest[:10]])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cold-start import times for the kpopcharts modules.')
+    parser.add_argument('modules', nargs='*', default=modules)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    results = list()
+
+    for module in args.modules:
+        result = dict(stage='import', module=module)
+        result.update(measure(module, args.repeat))
+        results.append(result)
+
+        print('{0:<60} {1:>10.4f}s  {2}'.format('stage=import module={0}'.format(module), result['min'],
+            ', '.join('{0} {1:.4f}s'.format(item['module'], item['own']) for item in result['heaviest'][:3])),
+            file=sys.stderr)
+
+    report = dict(revision=run.git_revision(),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  time=datetime.datetime.utcnow().isoformat(),
+                  results=results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# stdlib
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# our stuff
+from kpopcharts import aggregate
+from kpopcharts import kpopcharts
+from . import fixtures
+
+def measure(setup, run, repeat):
+    times = list()
+
+    for i in range(repeat):
+        state = setup()
+        gc.collect()
+
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    # Peak memory is taken from one extra run, since tracing allocations
+    # slows everything down too much to time the same run.
+    state = setup()
+    gc.collect()
+
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(min=min(times), median=statistics.median(times), peak_bytes=peak)
+
+# Chart's own default.
+default_limit = 50
+
+def bench_parse(args):
+    for source, (chart_class, generate) in sorted(fixtures.pages.items()):
+        if args.pages:
+            path = os.path.join(args.pages, source + '.html')
+
+            if not os.path.exists(path):
+                continue
+
+            with open(path, 'rb') as page_file:
+                cases = [(None, page_file.read())]
+        else:
+            cases = [(size, generate(size)) for size in args.sizes]
+
+        for size, page in cases:
+            params = dict(stage='parse', source=source, entries=size, page_bytes=len(page))
+            limits = [(size if size is not None else 100000, params)]
+
+            # The charts only ever show the default limit's worth of rows, so
+            # parsing should stop there however big the page is.
+            if size is None or size > default_limit:
+                limits.append((default_limit, dict(params, limit=default_limit)))
+
+            for limit, params in limits:
+                run = lambda page, limit=limit: chart_class(limit=limit, transport=fixtures.FixtureTransport(page))
+
+                yield params, lambda page=page: page, run
+
+def bench_normalize(args):
+    for size in args.normalize_sizes:
+        for charts in args.charts:
+            setup = lambda size=size, charts=charts: fixtures.synthetic_charts(size, charts)
+            run = lambda charts: kpopcharts.NormalizedChartList(*charts)
+
+            yield dict(stage='normalize', entries=size, charts=charts), setup, run
+
+def bench_render(args):
+    for size in args.sizes:
+        for charts in args.charts:
+            # Rendering doesn't care whether the charts were normalized, so
+            # skip that here; it would dominate setup at the larger sizes.
+            setup = lambda size=size, charts=charts: fixtures.synthetic_charts(size, charts)
+            run = lambda charts, size=size: str(kpopcharts.RedditChartsTable(charts, limit=size))
+
+            yield dict(stage='render', entries=size, charts=charts), setup, run
+
+def bench_aggregate(args):
+    for size in args.sizes:
+        for charts in args.charts:
+            for method in ('rrf', 'borda'):
+                setup = lambda size=size, charts=charts: fixtures.synthetic_charts(size, charts)
+                run = lambda charts, method=method: aggregate.aggregate(charts, method=method)
+
+                yield dict(stage='aggregate', entries=size, charts=charts, method=method), setup, run
+
+stages = [('parse', bench_parse), ('normalize', bench_normalize), ('render', bench_render), ('aggregate', bench_aggregate)]
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    results = list()
+
+    for name, bench in stages:
+        if name not in args.stages:
+            continue
+
+        for params, setup, run in bench(args):
+            result = dict(params)
+            result.update(measure(setup, run, args.repeat))
+            results.append(result)
+
+            print('{0:<60} {1:>10.4f}s {2:>12,d} B'.format(
+                ' '.join('{0}={1}'.format(key, value) for key, value in sorted(params.items())),
+                result['min'], result['peak_bytes']), file=sys.stderr)
+
+    report = dict(revision=git_revision(),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  time=datetime.datetime.utcnow().isoformat(),
+                  results=results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+
+def _result_key(result):
+    return tuple(sorted((key, value) for key, value in result.items()
+        if key not in ('min', 'median', 'peak_bytes', 'heaviest')))
+
+def compare(old_path, new_path):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old = json.load(old_file)
+        new = json.load(new_file)
+
+    old_results = dict((_result_key(result), result) for result in old['results'])
+
+    print('{0:<60} {1:>10} {2:>10} {3:>8} {4:>8}'.format('benchmark', 'old', 'new', 'time', 'memory'))
+
+    for result in new['results']:
+        key = _result_key(result)
+
+        if key not in old_results:
+            continue
+
+        before = old_results[key]
+
+        # Import timings (benchmarks.importtime) have no memory figure.
+        if 'peak_bytes' in before and 'peak_bytes' in result:
+            memory = '{0:>7.2f}x'.format(float(result['peak_bytes']) / before['peak_bytes'] if before['peak_bytes'] else float('inf'))
+        else:
+            memory = '{0:>8}'.format('-')
+
+        print('{0:<60} {1:>9.4f}s {2:>9.4f}s {3:>7.2f}x {4}'.format(
+            ' '.join('{0}={1}'.format(name, value) for name, value in key),
+            before['min'], result['min'], result['min'] / before['min'] if before['min'] else float('inf'),
+            memory))
+
+def record(directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for source, (chart_class, generate) in sorted(fixtures.pages.items()):
+        with open(os.path.join(directory, source + '.html'), 'wb') as page_file:
+            page_file.write(chart_class.fetch().content)
+
+def _numbers(text):
+    return [int(number) for number in text.split(',') if number]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks for chart parsing, normalization, rendering and aggregation.')
+    parser.add_argument('--stages', type=lambda text: text.split(','), default=[name for name, bench in stages])
+    parser.add_argument('--sizes', type=_numbers, default=[50, 500, 5000])
+    parser.add_argument('--normalize-sizes', type=_numbers, default=[50, 500, 2000])
+    parser.add_argument('--charts', type=_numbers, default=[2, 3, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pages', help='directory of <source>.html pages saved with --record to parse instead of synthetic ones')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--record', metavar='DIR', help='save the live chart pages into DIR and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.record:
+        record(args.record)
+    else:
+        run(args)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import importlib
+
+# Stands in for a module until one of its attributes is first used, so
+# importing kpopcharts doesn't pay for lxml, ftfy, requests, numpy and the
+# Google API client until something actually needs them. The import itself
+# goes through importlib.import_module, which is safe to race from several
+# threads (unlike importlib.util.LazyLoader before Python 3.12).
+class _Module():
+    def __init__(self, name, submodules):
+        self.__dict__['_name'] = name
+        self.__dict__['_submodules'] = submodules
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+
+        if module is None:
+            module = importlib.import_module(self._name)
+
+            for submodule in self._submodules:
+                importlib.import_module('{0}.{1}'.format(self._name, submodule))
+
+            self.__dict__['_module'] = module
+
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return '<lazy module {0!r}>'.format(self._name)
+
+def load(name, *submodules):
+    return _Module(name, submodules)
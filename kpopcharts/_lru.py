@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import collections
+import threading
+
+_missing = object()
+
+# A dict-like cache that forgets its least recently used keys past maxsize,
+# for state that would otherwise grow for as long as a process runs.
+class LRUCache():
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    # Reads are hot (Artist.name goes through one) and mostly miss, so only
+    # a hit takes the lock, to mark the key as recently used.
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+
+            return value
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _missing)
+
+        if value is _missing:
+            return default
+
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, items):
+        for key, value in dict(items).items():
+            self[key] = value
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
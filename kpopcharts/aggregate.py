@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# our stuff
+from . import _lazy
+from . import kpopcharts
+
+# third-party
+numpy = _lazy.load('numpy')
+
+class AggregateChart(list):
+    def __init__(self, name, chart_type, limit, entries=(), scores=()):
+        super(AggregateChart, self).__init__(entries)
+        self.name = name
+        self.chart_type = chart_type
+        self.limit = limit
+        self.url = ''
+        self.scores = list(scores)
+
+def _song_key(entry):
+    return '{0} - {1}'.format(str(entry.artists), entry.title)
+
+def rank_matrix(charts):
+    # One row per song and one column per chart, holding the song's rank in
+    # that chart or NaN if it isn't listed. Charts should have been through
+    # NormalizedChartList (or come from the archive) so the same song has the
+    # same title and artists everywhere.
+    songs = list()
+    rows = dict()
+    cells = list(), list(), list()
+
+    # Building the string key sorts the artists every time, which dominates
+    # long histories; artists are interned, so their ids can stand in for
+    # them while the charts are alive.
+    keys = dict()
+
+    for column, chart in enumerate(charts):
+        for position, entry in enumerate(chart):
+            identity = (entry.title,) + tuple(map(id, entry.artists))
+            key = keys.get(identity)
+
+            if key is None:
+                key = keys[identity] = _song_key(entry)
+
+            row = rows.get(key)
+
+            if row is None:
+                row = rows[key] = len(songs)
+                songs.append(entry)
+            elif entry.video and not songs[row].video:
+                songs[row] = entry
+
+            rank = kpopcharts._entry_rank(entry)
+
+            cells[0].append(row)
+            cells[1].append(column)
+            cells[2].append(rank if rank != float('inf') else position + 1)
+
+    ranks = numpy.full((len(songs), len(charts)), numpy.nan)
+
+    # A song listed twice in one chart keeps its best rank.
+    numpy.fmin.at(ranks, (numpy.array(cells[0], dtype=numpy.intp), numpy.array(cells[1], dtype=numpy.intp)),
+        numpy.array(cells[2], dtype=numpy.float64))
+
+    return songs, ranks
+
+def reciprocal_rank(ranks, weights, k=60):
+    return numpy.nansum(weights / (k + ranks), axis=1)
+
+def borda(ranks, weights, depths):
+    points = numpy.clip(depths - ranks + 1, 0, None)
+
+    return numpy.nansum(weights * points, axis=1)
+
+def aggregate(charts, method='rrf', weights=None, limit=50, name='All Charts', previous=None, k=60):
+    charts = list(charts)
+    songs, ranks = rank_matrix(charts)
+
+    weights = numpy.ones(len(charts)) if weights is None else numpy.asarray(weights, dtype=numpy.float64)
+
+    if weights.shape != (len(charts),):
+        raise ValueError('Expected {0} weights, got {1}.'.format(len(charts), weights.size))
+
+    if method == 'rrf':
+        scores = reciprocal_rank(ranks, weights, k)
+    elif method == 'borda':
+        # A chart's depth is how far down it goes, so a chart that lists more
+        # songs hands out more points at the top.
+        listed = numpy.where(numpy.isnan(ranks), 0, ranks)
+        depths = numpy.fmax([len(chart) for chart in charts], listed.max(axis=0) if len(songs) else 0)
+        scores = borda(ranks, weights, depths)
+    else:
+        raise ValueError('Unknown aggregation method {0!r}.'.format(method))
+
+    # Ties go to the song with the better best rank, then the one listed in
+    # more charts, then whichever was seen first.
+    listed = ~numpy.isnan(ranks)
+    best = numpy.where(listed, ranks, numpy.inf).min(axis=1) if len(charts) else numpy.zeros(len(songs))
+    order = numpy.lexsort((numpy.arange(len(songs)), -listed.sum(axis=1), best, -scores))[:limit]
+
+    positions = dict()
+
+    if previous is not None:
+        positions = dict((_song_key(entry), kpopcharts._entry_rank(entry)) for entry in previous)
+
+    entries = list()
+
+    for rank, row in enumerate(order.tolist(), 1):
+        song = songs[row]
+
+        entry = kpopcharts.ChartEntry()
+        entry.rank = rank
+        entry.title = song.title
+        entry.artists = kpopcharts.ArtistsList(song.artists)
+        entry.video = song.video
+
+        if previous is None:
+            entry.change = 'none'
+        elif _song_key(song) not in positions:
+            entry.change = 'new'
+        else:
+            before = positions[_song_key(song)]
+            entry.change = 'up' if before > rank else 'down' if before < rank else 'none'
+            entry.change_diff = abs(before - rank)
+
+        entries.append(entry)
+
+    chart_type = getattr(charts[0], 'chart_type', None) if charts else None
+
+    return AggregateChart(name, chart_type, limit, entries, scores[order].tolist())
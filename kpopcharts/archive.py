@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# stdlib
+import bisect
+import calendar
+import collections
+import datetime
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+
+# our stuff
+from . import kpopcharts
+
+# An archive is a directory of append-only files of fixed-size records:
+#
+#   strings          length-prefixed UTF-8 strings, numbered in file order
+#   entries          one record per chart entry
+#   snapshots        one record per archived chart, pointing at its entries;
+#                    written last, so it is what commits an append
+#   postings         (song, snapshot, rank) for every entry since the last
+#                    compaction, in append order
+#   postings.sorted  the compacted postings, sorted by song and snapshot,
+#                    behind a header with the number of snapshots covered
+#
+# Snapshots must be appended in time order, so both the snapshots file and
+# each song's postings can be binary searched.
+_string_length = struct.Struct('<I')
+_entry = struct.Struct('<HIhIII')
+_snapshot = struct.Struct('<dIBQH')
+_posting = struct.Struct('<IIH')
+_header = struct.Struct('<Q')
+
+class ArchiveError(Exception):
+    pass
+
+HistoryPoint = collections.namedtuple('HistoryPoint', ['time', 'source', 'chart_type', 'rank'])
+
+class Snapshot(list):
+    def __init__(self, name, chart_type, time, entries):
+        super(Snapshot, self).__init__(entries)
+        self.name = name
+        self.chart_type = chart_type
+        self.time = time
+        self.limit = len(entries)
+        self.url = ''
+
+def _timestamp(value):
+    if value is None:
+        return time.time()
+
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+    return float(value)
+
+def _song_key(title, artists):
+    return '{0} - {1}'.format(str(artists), title)
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+class _Keys():
+    # Sequence view of one key per record, for bisecting mapped files.
+    def __init__(self, length, key):
+        self._length = length
+        self._key = key
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        return self._key(i)
+
+class SnapshotArchive():
+    compact_threshold = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        for name in ('strings', 'entries', 'snapshots', 'postings'):
+            open(self._file(name), 'ab').close()
+
+        self._strings = list()
+        self._string_ids = dict()
+        self._strings_end = 0
+        self._maps = dict()
+        self._lock = threading.RLock()
+        self._recovered = False
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, name):
+        try:
+            stat = os.stat(self._file(name))
+        except FileNotFoundError:
+            return b''
+
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._maps.get(name)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if stat.st_size == 0:
+            view = b''
+        else:
+            with open(self._file(name), 'rb') as mapped:
+                view = mmap.mmap(mapped.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._maps[name] = (key, view)
+
+        return view
+
+    def _load_strings(self):
+        data = self._map('strings')
+        offset = self._strings_end
+
+        while offset + _string_length.size <= len(data):
+            (length,) = _string_length.unpack_from(data, offset)
+            start = offset + _string_length.size
+
+            if start + length > len(data):
+                break
+
+            value = data[start:start + length].decode('utf-8')
+            self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+            offset = start + length
+
+        self._strings_end = offset
+
+    def _string_id(self, value):
+        if value not in self._string_ids:
+            self._load_strings()
+
+        return self._string_ids.get(value)
+
+    def __len__(self):
+        return len(self._map('snapshots')) // _snapshot.size
+
+    def _snapshot(self, number):
+        return _snapshot.unpack_from(self._map('snapshots'), number * _snapshot.size)
+
+    def _recover(self):
+        # Drop whatever a writer that died halfway through an append left
+        # behind the last committed snapshot.
+        count = len(self)
+        end = 0
+
+        if count:
+            timestamp, source, chart_type, first, length = self._snapshot(count - 1)
+            end = first + length
+
+        self._load_strings()
+
+        postings = self._map('postings')
+        postings_end = len(postings) // _posting.size
+
+        while postings_end and _posting.unpack_from(postings, (postings_end - 1) * _posting.size)[1] >= count:
+            postings_end -= 1
+
+        for name, size in (('strings', self._strings_end), ('snapshots', count * _snapshot.size),
+                           ('entries', end * _entry.size), ('postings', postings_end * _posting.size)):
+            if os.path.getsize(self._file(name)) != size:
+                with open(self._file(name), 'r+b') as truncated:
+                    truncated.truncate(size)
+
+        self._recovered = True
+
+    def append(self, chart, timestamp=None):
+        timestamp = _timestamp(timestamp)
+
+        with self._lock:
+            if not self._recovered:
+                self._recover()
+
+            number = len(self)
+
+            if number and timestamp < self._snapshot(number - 1)[0]:
+                raise ArchiveError('Snapshots must be appended in time order.')
+
+            strings = bytearray()
+            entries = bytearray()
+            postings = bytearray()
+            new_strings = list()
+
+            def string_id(value):
+                value = str(value)
+                string = self._string_id(value)
+
+                if string is None:
+                    string = len(self._strings) + len(new_strings)
+                    self._string_ids[value] = string
+                    new_strings.append(value)
+
+                    encoded = value.encode('utf-8')
+                    strings.extend(_string_length.pack(len(encoded)))
+                    strings.extend(encoded)
+
+                return string
+
+            try:
+                for entry in chart:
+                    rank = _clamp(int(entry.rank or 0), 0, 0xffff)
+                    change_diff = _clamp(int(entry.change_diff or 0), -0x8000, 0x7fff)
+
+                    entries.extend(_entry.pack(rank, string_id(entry.change), change_diff, string_id(entry.title),
+                        string_id(entry.artists), string_id(entry.video)))
+                    postings.extend(_posting.pack(string_id(_song_key(entry.title, entry.artists)), number, rank))
+
+                source = string_id(chart.name)
+            except Exception:
+                for value in new_strings:
+                    del self._string_ids[value]
+
+                raise
+
+            first = os.path.getsize(self._file('entries')) // _entry.size
+            count = len(entries) // _entry.size
+
+            for name, data in (('strings', strings), ('entries', entries), ('postings', postings)):
+                with open(self._file(name), 'ab') as appended:
+                    appended.write(data)
+
+            with open(self._file('snapshots'), 'ab') as appended:
+                appended.write(_snapshot.pack(timestamp, source, chart.chart_type.value, first, count))
+
+            self._strings.extend(new_strings)
+            self._strings_end += len(strings)
+
+            if os.path.getsize(self._file('postings')) // _posting.size >= self.compact_threshold:
+                self.compact()
+
+        return number
+
+    def _sorted_postings(self):
+        data = self._map('postings.sorted')
+
+        if not data:
+            return 0, data, 0
+
+        return _header.unpack_from(data, 0)[0], data, (len(data) - _header.size) // _posting.size
+
+    def compact(self):
+        with self._lock:
+            count = len(self)
+            covered, data, length = self._sorted_postings()
+
+            log = self._map('postings')
+            pending = sorted(posting for posting in _posting.iter_unpack(log[:len(log) // _posting.size * _posting.size])
+                if covered <= posting[1] < count)
+
+            compacted = _posting.iter_unpack(data[_header.size:_header.size + length * _posting.size]) if length else ()
+            temporary = self._file('postings.sorted.tmp')
+
+            with open(temporary, 'wb') as output:
+                output.write(_header.pack(count))
+
+                for posting in heapq.merge(compacted, pending):
+                    output.write(_posting.pack(*posting))
+
+            os.replace(temporary, self._file('postings.sorted'))
+
+            # Replaced rather than truncated, so readers that still have the
+            # old log mapped don't fault on it.
+            open(temporary, 'wb').close()
+            os.replace(temporary, self._file('postings'))
+
+    def _postings(self, song):
+        covered, data, length = self._sorted_postings()
+        songs = _Keys(length, lambda i: _posting.unpack_from(data, _header.size + i * _posting.size)[0])
+        low = bisect.bisect_left(songs, song)
+        high = bisect.bisect_right(songs, song, low)
+
+        for i in range(low, high):
+            yield _posting.unpack_from(data, _header.size + i * _posting.size)
+
+        # The uncompacted tail is bounded by compact_threshold.
+        log = self._map('postings')
+
+        for posting in _posting.iter_unpack(log[:len(log) // _posting.size * _posting.size]):
+            if posting[0] == song and posting[1] >= covered:
+                yield posting
+
+    def history(self, title, artists, source=None, chart_type=None, start=None, end=None):
+        start = _timestamp(start) if start is not None else None
+        end = _timestamp(end) if end is not None else None
+        history = list()
+
+        with self._lock:
+            song = self._string_id(_song_key(title, artists))
+
+            if song is None:
+                return history
+
+            count = len(self)
+
+            for song, number, rank in self._postings(song):
+                if number >= count:
+                    continue
+
+                timestamp, source_id, chart_type_value, first, length = self._snapshot(number)
+
+                if source is not None and self._strings[source_id] != source:
+                    continue
+
+                if chart_type is not None and chart_type_value != chart_type.value:
+                    continue
+
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+
+                history.append(HistoryPoint(datetime.datetime.utcfromtimestamp(timestamp), self._strings[source_id],
+                    kpopcharts.ChartType(chart_type_value), rank))
+
+        return sorted(history, key=lambda point: point.time)
+
+    def top(self, source, chart_type=None, at=None, limit=None):
+        at = _timestamp(at)
+
+        with self._lock:
+            source_id = self._string_id(source)
+
+            if source_id is None:
+                return None
+
+            number = bisect.bisect_right(_Keys(len(self), lambda i: self._snapshot(i)[0]), at) - 1
+
+            while number >= 0:
+                timestamp, snapshot_source, chart_type_value, first, length = self._snapshot(number)
+
+                if snapshot_source == source_id and (chart_type is None or chart_type_value == chart_type.value):
+                    return self._read_snapshot(timestamp, snapshot_source, chart_type_value, first,
+                        length if limit is None else min(limit, length))
+
+                number -= 1
+
+        return None
+
+    def _read_snapshot(self, timestamp, source, chart_type, first, length):
+        self._load_strings()
+
+        data = self._map('entries')
+        entries = list()
+
+        for rank, change, change_diff, title, artists, video in _entry.iter_unpack(
+                data[first * _entry.size:(first + length) * _entry.size]):
+            entry = kpopcharts.ChartEntry()
+            entry.rank = rank
+            entry.change = self._strings[change]
+            entry.change_diff = change_diff
+            entry.title = self._strings[title]
+            entry.video = self._strings[video]
+
+            if self._strings[artists]:
+                entry.artists = kpopcharts.ArtistsList(kpopcharts.Artist(name)
+                    for name in self._strings[artists].split(', '))
+
+            entries.append(entry)
+
+        return Snapshot(self._strings[source], kpopcharts.ChartType(chart_type),
+            datetime.datetime.utcfromtimestamp(timestamp), entries)
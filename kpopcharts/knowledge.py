@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import sqlite3
+import threading
+
+# Canonical titles, artist aliases and artist name substitutions found by
+# NormalizedChartList, kept between runs so known strings skip the fuzzy
+# matching. Everything is stored as plain strings.
+class KnowledgeBase():
+    _tables = ('titles', 'artists', 'substitutions')
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._saved = dict((table, dict()) for table in self._tables)
+
+        with self._lock, self._db:
+            for table in self._tables:
+                self._db.execute('CREATE TABLE IF NOT EXISTS {0} (name TEXT PRIMARY KEY, canonical TEXT NOT NULL)'.format(table))
+
+    def load(self):
+        with self._lock:
+            for table in self._tables:
+                self._saved[table] = dict(self._db.execute('SELECT name, canonical FROM {0}'.format(table)))
+
+            return tuple(dict(self._saved[table]) for table in self._tables)
+
+    def save(self, titles, artists, substitutions):
+        with self._lock, self._db:
+            for table, mapping in zip(self._tables, (titles, artists, substitutions)):
+                saved = self._saved[table]
+                changed = [(name, canonical) for name, canonical in mapping.items() if saved.get(name) != canonical]
+
+                if changed:
+                    self._db.executemany('INSERT OR REPLACE INTO {0} (name, canonical) VALUES (?, ?)'.format(table), changed)
+                    saved.update(changed)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -17,24 +17,40 @@
 
 # stdlib
 import abc
+import array
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import datetime
-import difflib
 import enum
 import functools
+import io
 import re
 import socket
 import string
+import threading
+import time
 import urllib.parse
-import urllib.request
+import weakref
 
 # our stuff
+from . import _lazy
+from . import metrics
+from ._lru import LRUCache
+from . import similarity
 from . import youtube
+from .transport import Transport
 
 # third-party
-import ftfy
-import lxml.etree
-import lxml.html
+ftfy = _lazy.load('ftfy')
+lxml = _lazy.load('lxml', 'etree', 'html')
+
+def _fix_encoding(text):
+    with metrics.timer('ftfy'):
+        return ftfy.fix_encoding(text)
 
 class ChartError(Exception):
     pass
@@ -51,30 +67,80 @@ class ChartType(enum.Enum):
     AlbumWeek = 3
 
 # FIXME TODO: Enumify ChartEntry.change.
-class ChartEntry(dict):
+class ChartEntry():
+    __slots__ = ('rank', 'artists', 'title', 'video', 'change', 'change_diff')
+
     def __init__(self):
-        super(ChartEntry, self).__init__(rank='', artists=ArtistsList(), title='', video='', change='', change_diff=0)
-        self.__dict__ = self
+        self.rank = ''
+        self.artists = ArtistsList()
+        self.title = ''
+        self.video = ''
+        self.change = ''
+        self.change_diff = 0
+
+    def __repr__(self):
+        return 'ChartEntry({0})'.format(', '.join('{0}={1!r}'.format(name, getattr(self, name))
+            for name in ChartEntry.__slots__))
+
+    def copy(self):
+        entry = ChartEntry()
+
+        for name in ChartEntry.__slots__:
+            setattr(entry, name, getattr(self, name))
+
+        entry.artists = ArtistsList(self.artists)
+
+        return entry
 
     @staticmethod
     def _similar(a, b):
-        return (difflib.SequenceMatcher(None, str(a), str(b)).ratio() > 0.8)
+        return _similarity.similar(str(a), str(b))
 
 # FIXME TODO: Clean up ugly bullshit magic coupling between this and
 # NormalizedChartList.__normalize to hash on extracted artist but render
 # from substitution cache, which __normalize also inserts into.
 @functools.total_ordering
 class Artist:
-    def __init__(self, name):
-        name = ftfy.fix_encoding(name)
-        self._name = self._english_artist(name)
+    __slots__ = ('_name', '_hash', '_score', '__weakref__')
+
+    # Artists are interned by the raw name they were built from, so each
+    # distinct name is only fixed up and scored once while it's in use.
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, name):
+        artist = cls._interned.get(name)
+
+        if artist is None:
+            artist = super(Artist, cls).__new__(cls)
+            artist._name = artist._english_artist(_fix_encoding(name))
+            artist._hash = hash(artist._name)
+            artist._score = Artist._english_score(artist._name)
+            artist = cls._interned.setdefault(name, artist)
+
+        return artist
+
+    # Substitutions that follow from a name alone are shared; the ones
+    # normalization discovers belong to the current NormalizationContext.
+    _parsed_substitutions = LRUCache(1 << 16)
+
+    _english_regex = re.compile('(.+)\((.+)\)')
+    _ascii_letters = frozenset(string.ascii_letters)
 
-    _substitution_cache = dict()
+    @staticmethod
+    def _substitution(name):
+        substitution = _substitutions().get(name)
+
+        if substitution is None:
+            substitution = Artist._parsed_substitutions.get(name)
+
+        return substitution
 
     @property
     def name(self):
-        if self._name in self._substitution_cache:
-            return self._substitution_cache[self._name]
+        substitution = Artist._substitution(self._name)
+
+        if substitution is not None:
+            return substitution
         else:
             return self._name
 
@@ -82,15 +148,23 @@ class Artist:
         return self.name
 
     def __hash__(self):
-        return self._name.__hash__()
+        return self._hash
 
     def __lt__(self, other):
         return self.name.__lt__(str(other))
 
+    def __reduce__(self):
+        return (Artist, (self._name,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     @staticmethod
     def _english_artist(text):
-        pattern = re.compile('(.+)\((.+)\)')
-        matches = pattern.search(text)
+        matches = Artist._english_regex.search(text)
 
         if matches is None:
             return text
@@ -101,26 +175,31 @@ class Artist:
                 return text.strip()
             else:
                 if compare == 1:
-                    Artist._substitution_cache[matches.groups()[1].strip()] = matches.groups()[0].strip()
+                    Artist._parsed_substitutions[matches.groups()[1].strip()] = matches.groups()[0].strip()
                     return matches.groups()[0].strip()
                 else:
                     return matches.groups()[1].strip()
-                    Artist._substitution_cache[matches.groups()[0].strip()] = matches.groups()[1].strip()
+                    Artist._parsed_substitutions[matches.groups()[0].strip()] = matches.groups()[1].strip()
 
     @staticmethod
     def _english_score(text):
-        text = str(text)
-        count = len(text)
-        ascii = 0
+        if isinstance(text, Artist):
+            if Artist._substitution(text._name) is None:
+                return text._score
 
-        for char in text:
-            if char in string.ascii_letters:
-                ascii += 1
+            text = text.name
+
+        return Artist._text_english_score(str(text))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _text_english_score(text):
+        ascii = sum(1 for char in text if char in Artist._ascii_letters)
 
         if ascii == 0:
             return 0
         else:
-            return float(count) / float(ascii)
+            return float(len(text)) / float(ascii)
 
     @staticmethod
     def _english_cmp(x, y):
@@ -142,8 +221,31 @@ class ArtistsSet(set):
     def __str__(self):
         return ', '.join(sorted(map(str, self)))
 
+def _deadline(timeout):
+    return time.monotonic() + timeout if timeout is not None else None
+
 class Chart(list):
-    def __init__(self, chart_type=None, limit=50):
+    _headers = dict()
+
+    # Entries parsed from the last page fetched for each (class, url, limit),
+    # handed out again as copies when the server answers 304.
+    _parsed = dict()
+
+    def __init__(self, chart_type=None, limit=50, transport=None, timeout=None, retries=0, hedge=None):
+        self._configure(chart_type, limit)
+        self.transport = transport if transport is not None else Transport.shared()
+
+        # timeout bounds the whole fetch, retries included; see Transport.get.
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+
+        try:
+            self._fetch_chart()
+        except Exception as e:
+            raise ChartFetchError('Error fetching {0} chart. Try again!'.format(self.name))
+
+    def _configure(self, chart_type, limit):
         self.chart_type = chart_type if chart_type is not None else self._default_chart_type
 
         if (self.chart_type not in self.supported_chart_types):
@@ -152,10 +254,37 @@ class Chart(list):
         self.limit = limit
         self.url = self._url_from_chart_type()
 
+    @classmethod
+    def fetch(cls, chart_type=None, limit=50, transport=None, timeout=None, retries=0, hedge=None):
+        chart = cls.__new__(cls)
+        chart._configure(chart_type, limit)
+        transport = transport if transport is not None else Transport.shared()
+
+        return transport.get(chart.url, headers=cls._headers, deadline=_deadline(timeout),
+            retries=retries, hedge=hedge)
+
+    # Builds a chart from a page we already have (bytes, a file object or a
+    # path) without touching the network, so it also skips anything
+    # _complete_chart would look up. Both the method and its result pickle,
+    # so pages can be parsed in a process pool.
+    @classmethod
+    def parse(cls, page, chart_type=None, limit=50):
+        chart = cls.__new__(cls)
+        chart._configure(chart_type, limit)
+        chart.transport = None
+
         try:
-            self._fetch_chart()
+            chart._parse_page(page)
         except Exception as e:
-            raise ChartFetchError('Error fetching {0} chart. Try again!'.format(self.name))
+            raise ChartBuildError('Error parsing {0} chart!'.format(chart.name))
+
+        return chart
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['transport'] = None
+
+        return state
 
     @property
     @abc.abstractmethod
@@ -177,34 +306,258 @@ class Chart(list):
         pass
 
     @abc.abstractmethod
-    def _fetch_chart(self):
+    def _parse_chart(self, root):
+        pass
+
+    def _complete_chart(self):
         pass
 
-class NormalizedChartList(collections.MutableSequence):
-    def __init__(self, *args):
+    def _parse_page(self, page):
+        if isinstance(page, (bytes, bytearray)):
+            page = io.BytesIO(page)
+
+        rows = len(self)
+
+        with metrics.timer('parse', source=self.name):
+            self._parse_chart(lxml.html.parse(page))
+
+        metrics.count('rows_parsed', len(self) - rows, source=self.name)
+
+    def _fetch_chart(self):
+        response = self.transport.get(self.url, headers=self._headers, deadline=_deadline(self.timeout),
+            retries=self.retries, hedge=self.hedge)
+        key = (type(self), self.url, self.limit)
+        parsed = self._parsed.get(key)
+
+        if not response.modified and parsed is not None and parsed[0] is response.content:
+            self.extend(entry.copy() for entry in parsed[1])
+        else:
+            self._parse_page(response.content)
+            Chart._parsed[key] = (response.content, [entry.copy() for entry in self])
+
+        self._complete_chart()
+
+    def columnar(self):
+        return ColumnarChart(self)
+
+    def copy(self):
+        chart = copy.copy(self)
+        chart.transport = self.transport
+        chart[:] = [entry.copy() for entry in self]
+
+        return chart
+
+class _ValueTable():
+    def __init__(self):
+        self.values = list()
+        self._indices = dict()
+
+    def _key(self, value):
+        return value
+
+    def index(self, value):
+        key = self._key(value)
+
+        if key not in self._indices:
+            self._indices[key] = len(self.values)
+            self.values.append(value)
+
+        return self._indices[key]
+
+class _ObjectTable(_ValueTable):
+    # Artist collections are mutable (and so unhashable), but entries that
+    # were reconciled share the very same object, so intern by identity.
+    def _key(self, value):
+        return id(value)
+
+class ColumnarEntry():
+    __slots__ = ('_chart', '_index')
+
+    def __init__(self, chart, index):
+        self._chart = chart
+        self._index = index
+
+    def _column(name, table=None):
+        def get(self):
+            value = getattr(self._chart, name)[self._index]
+            return getattr(self._chart, table).values[value] if table else value
+
+        def set(self, value):
+            if table:
+                value = getattr(self._chart, table).index(value)
+
+            getattr(self._chart, name)[self._index] = value
+
+        return property(get, set)
+
+    rank = _column('_ranks')
+    change = _column('_changes', '_change_table')
+    change_diff = _column('_change_diffs')
+    title = _column('_titles', '_title_table')
+    artists = _column('_artists', '_artist_table')
+    video = _column('_videos', '_video_table')
+
+    del _column
+
+    def __repr__(self):
+        return 'ColumnarEntry({0})'.format(', '.join('{0}={1!r}'.format(name, getattr(self, name))
+            for name in ChartEntry.__slots__))
+
+    def copy(self):
+        entry = ChartEntry()
+
+        for name in ChartEntry.__slots__:
+            setattr(entry, name, getattr(self, name))
+
+        entry.artists = ArtistsList(self.artists)
+
+        return entry
+
+class ColumnarChart(collections.abc.Sequence):
+    def __init__(self, chart=()):
+        self.name = getattr(chart, 'name', '')
+        self.chart_type = getattr(chart, 'chart_type', None)
+        self.limit = getattr(chart, 'limit', 0)
+        self.url = getattr(chart, 'url', '')
+
+        self._clear()
+
+        for entry in chart:
+            self.append(entry)
+
+    def _clear(self):
+        self._ranks = array.array('l')
+        self._changes = array.array('B')
+        self._change_diffs = array.array('l')
+        self._titles = array.array('L')
+        self._artists = array.array('L')
+        self._videos = array.array('L')
+
+        self._change_table = _ValueTable()
+        self._title_table = _ValueTable()
+        self._artist_table = _ObjectTable()
+        self._video_table = _ValueTable()
+
+    def append(self, entry):
+        self._ranks.append(int(entry.rank or 0))
+        self._changes.append(self._change_table.index(entry.change))
+        self._change_diffs.append(int(entry.change_diff or 0))
+        self._titles.append(self._title_table.index(entry.title))
+        self._artists.append(self._artist_table.index(entry.artists))
+        self._videos.append(self._video_table.index(entry.video))
+
+    def compact(self):
+        # Tables only ever grow as entries are rewritten; rebuild them from
+        # the values still in use.
+        entries = [entry.copy() for entry in self]
+
+        for entry, original in zip(entries, self):
+            entry.artists = original.artists
+
+        self._clear()
+
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [ColumnarEntry(self, i) for i in range(*key.indices(len(self)))]
+
+        if key < 0:
+            key += len(self)
+
+        if not 0 <= key < len(self):
+            raise IndexError('chart index out of range')
+
+        return ColumnarEntry(self, key)
+
+class NormalizationContext():
+    def __init__(self, maxsize=1 << 16):
+        self.substitutions = LRUCache(maxsize)
+        self._tokens = threading.local()
+
+    def __enter__(self):
+        if not hasattr(self._tokens, 'stack'):
+            self._tokens.stack = list()
+
+        self._tokens.stack.append(_normalization.set(self))
+
+        return self
+
+    def __exit__(self, *args):
+        _normalization.reset(self._tokens.stack.pop())
+
+_normalization = contextvars.ContextVar('normalization', default=NormalizationContext())
+
+def _substitutions():
+    return _normalization.get().substitutions
+
+# Runs fn in a copy of the submitting thread's context, so worker threads
+# see the same YouTube session and normalization context.
+def _submit(executor, fn, *args):
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+# Pair scores only depend on the two strings, so one engine (and its score
+# cache) serves every normalization pass.
+_similarity = similarity.SimilarityEngine()
+
+class NormalizedChartList(collections.abc.MutableSequence):
+    def __init__(self, *args, incremental=False, knowledge=None, context=None):
         self.__list = list()
+        self.__titles = dict()
+        self.__artists = dict()
+        self.__artist_names = dict()
+        self.__pending = list()
+        self.__dirty = False
+        self.__batches = 0
+        self.incremental = incremental
+        self.knowledge = knowledge
+
+        # Normalization runs lazily, so hold on to the context the list was
+        # made in rather than whichever is current at the time.
+        self.context = context if context is not None else _normalization.get()
+
+        if knowledge is not None:
+            self.__titles, self.__artist_names, substitutions = knowledge.load()
+            self.context.substitutions.update(substitutions)
 
         if len(args):
             self.__list.extend(args)
-            self.__normalize()
+            self.__dirty = True
+            self.__changed()
 
     def __str__(self):
+        self.__flush()
         return self.__list.__str__()
 
     def insert(self, i, value):
-        self.__list.insert(i, value)
-        self.__normalize()
+        if i >= len(self.__list):
+            self.append(value)
+        else:
+            self.__list.insert(i, value)
+            self.__dirty = True
+            self.__changed()
 
     def append(self, value):
+        if self.incremental and self.__list and not self.__dirty:
+            self.__pending.append(value)
+        else:
+            self.__dirty = True
+
         self.__list.append(value)
-        self.__normalize()
+        self.__changed()
 
     def __getitem__(self, key):
+        self.__flush()
         return self.__list[key]
 
     def __setitem__(self, key, value):
         self.__list[key] = value
-        self.__normalize()
+        self.__dirty = True
+        self.__changed()
 
     def __delitem__(self, key):
         self.__list.remove(key)
@@ -212,33 +565,153 @@ class NormalizedChartList(collections.MutableSequence):
     def __len__(self):
         return len(self.__list)
 
+    @contextlib.contextmanager
+    def batch(self):
+        self.__batches += 1
+
+        try:
+            yield self
+        finally:
+            self.__batches -= 1
+
+        self.__changed()
+
+    def normalize(self):
+        self.__dirty = True
+        self.__flush()
+
+    def __changed(self):
+        if not self.__batches:
+            self.__flush()
+
+    def __flush(self):
+        if not self.__dirty and not self.__pending:
+            return
+
+        with self.context:
+            if self.__dirty and self.knowledge is not None and self.__titles:
+                with metrics.timer('normalize', mode='known'):
+                    self.__normalize_known()
+            elif self.__dirty:
+                with metrics.timer('normalize', mode='full'):
+                    self.__normalize()
+            else:
+                for chart in self.__pending:
+                    with metrics.timer('normalize', mode='incremental'):
+                        self.__normalize_chart(chart)
+
+            if self.knowledge is not None and (self.__dirty or self.__pending):
+                self.__artist_names.update((artist._name, canonical._name) for artist, canonical in self.__artists.items())
+                self.knowledge.save(self.__titles, self.__artist_names, dict(self.context.substitutions.items()))
+
+            self.__pending = list()
+            self.__dirty = False
+
     __english_sort_key = functools.cmp_to_key(Artist._english_cmp)
 
+    @staticmethod
+    def __similar_index(keys, outer_keys=None):
+        return _similarity.index(keys, outer_keys)
+
+    @staticmethod
+    def __strip_titles(entries):
+        for entry in entries:
+            entry.title = re.sub(r'\((?!Korean|Chinese|Japanese)[^)]*?\)', '',
+                entry.title, flags=re.IGNORECASE).strip()
+            entry.title = re.sub(r'\((?!Korean|Chinese|Japanese)[^)]*?\)', '',
+                entry.title, flags=re.IGNORECASE).strip()
+
+    def __reconcile_artists(self, entries, new_entries=None):
+        positions = collections.OrderedDict()
+
+        for position, entry in enumerate(entries):
+            positions.setdefault(entry.title, list()).append(position)
+
+        similar_titles = self.__similar_index(list(positions))
+        candidates = dict()
+
+        for title, similar in similar_titles.items():
+            candidates[title] = sorted(position for other in similar for position in positions[other])
+
+        scores = dict()
+        touched = set()
+        substitutions = _substitutions()
+
+        def artists_score(artists):
+            if id(artists) not in scores:
+                scores[id(artists)] = (artists, sum(Artist._english_score(artist) for artist in artists))
+
+            return scores[id(artists)][1]
+
+        for outer_entry in entries:
+            for position in candidates[outer_entry.title]:
+                inner_entry = entries[position]
+
+                if new_entries is not None and id(outer_entry) not in new_entries and id(inner_entry) not in new_entries:
+                    continue
+
+                inner_score = artists_score(inner_entry.artists)
+                outer_score = artists_score(outer_entry.artists)
+
+                if inner_score > outer_score:
+                    if len(outer_entry.artists) == 1 and len(inner_entry.artists) == 1:
+                        substitutions[next(iter(outer_entry.artists)).name] = next(iter(inner_entry.artists)).name
+                        scores.clear()
+
+                    outer_entry.artists = inner_entry.artists
+                    touched.add(id(outer_entry))
+                elif outer_score > inner_score:
+                    if len(outer_entry.artists) == 1 and len(inner_entry.artists) == 1:
+                        substitutions[next(iter(inner_entry.artists)).name] = next(iter(outer_entry.artists)).name
+                        scores.clear()
+
+                    inner_entry.artists = outer_entry.artists
+                    touched.add(id(inner_entry))
+
+        return touched
+
+    @staticmethod
+    def __apply_artists(entries, normalized_artists):
+        substitutions = _substitutions()
+
+        for entry in entries:
+            artists = ArtistsSet()
+            names = set()
+
+            for artist in entry.artists:
+                normalized_artist = normalized_artists[artist]
+                normalized_artist = (substitutions[normalized_artist] if normalized_artist
+                    in substitutions else normalized_artist)
+
+                # Credits a substitution gave the same name are one artist.
+                if str(normalized_artist) not in names:
+                    names.add(str(normalized_artist))
+                    artists.add(normalized_artist)
+
+            entry.artists = artists
+
+    def __propagate_videos(self, charts):
+        for chart in charts:
+            for outer_entry in chart:
+                for inner_entry in self.__list[0]:
+                    if outer_entry.title == inner_entry.title:
+                        outer_entry.video = inner_entry.video
+
     def __normalize(self):
         normalized_titles = dict()
 
-        for chart in self.__list:
-            for entry in chart:
-                entry.title = re.sub(r'\((?!Korean|Chinese|Japanese)[^)]*?\)', '',
-                    entry.title, flags=re.IGNORECASE).strip()
-                entry.title = re.sub(r'\((?!Korean|Chinese|Japanese)[^)]*?\)', '',
-                    entry.title, flags=re.IGNORECASE).strip()
+        self.__strip_titles(entry for chart in self.__list for entry in chart)
 
-        for chart in self.__list:
-            for entry in chart:
-                if not entry.title in normalized_titles:
-                    normalized_titles[entry.title] = set()
-                    normalized_titles[entry.title].add(entry.title)
+        titles = collections.OrderedDict.fromkeys(entry.title for chart in self.__list for entry in chart)
 
-        for outer_title in normalized_titles:
-            for inner_title, mapping in normalized_titles.items():
-                if ChartEntry._similar(outer_title, inner_title):
-                    mapping.add(outer_title)
-                    normalized_titles[outer_title].add(inner_title)
+        # Every title in a cluster of similar ones maps to the same
+        # canonical title, even where the two ends of a chain of near
+        # matches aren't similar themselves.
+        for cluster in _similarity.clusters(titles):
+            canonical = sorted(sorted(cluster), key=self.__english_sort_key)[0]
 
-        for key, value in normalized_titles.items():
-            sorted_titles = sorted(sorted(value), key=self.__english_sort_key)
-            normalized_titles[key] = sorted_titles[0]
+            for title in cluster:
+                normalized_titles[title] = canonical
 
         for chart in self.__list:
             for entry in chart:
@@ -246,64 +719,108 @@ class NormalizedChartList(collections.MutableSequence):
 
         normalized_artists = dict()
 
-        for outer_chart in self.__list:
-            for outer_entry in outer_chart:
-                for inner_chart in self.__list:
-                    for inner_entry in inner_chart:
-                        if ChartEntry._similar(outer_entry.title, inner_entry.title):
-                            inner_score = sum(Artist._english_score(artist) for artist in inner_entry.artists)
-                            outer_score = sum(Artist._english_score(artist) for artist in outer_entry.artists)
+        self.__reconcile_artists([entry for chart in self.__list for entry in chart])
 
-                            if inner_score > outer_score:
-                                if len(outer_entry.artists) == 1 and len(inner_entry.artists) == 1:
-                                    Artist._substitution_cache[outer_entry.artists[0].name] = inner_entry.artists[0].name
+        artists = collections.OrderedDict.fromkeys(artist for chart in self.__list
+            for entry in chart for artist in entry.artists)
 
-                                outer_entry.artists = inner_entry.artists
-                            elif outer_score > inner_score:
-                                if len(outer_entry.artists) == 1 and len(inner_entry.artists) == 1:
-                                    Artist._substitution_cache[inner_entry.artists[0].name] = outer_entry.artists[0].name
+        for cluster in _similarity.clusters(artists):
+            canonical = sorted(cluster, key=self.__english_sort_key)[0]
 
-                                inner_entry.artists = outer_entry.artists
+            for artist in cluster:
+                normalized_artists[artist] = canonical
 
-        for chart in self.__list:
-            for entry in chart:
-                for artist in entry.artists:
-                    if not artist in normalized_artists:
-                        normalized_artists[artist] = ArtistsSet()
-                        normalized_artists[artist].add(artist)
+        self.__apply_artists((entry for chart in self.__list for entry in chart), normalized_artists)
+        self.__propagate_videos(self.__list[1:])
 
-        for outer_artist in normalized_artists:
-            for inner_artist, mapping in normalized_artists.items():
-                if ChartEntry._similar(outer_artist, inner_artist):
-                    mapping.add(outer_artist)
-                    normalized_artists[outer_artist].add(inner_artist)
+        self.__titles = normalized_titles
+        self.__artists = normalized_artists
 
-        for key, value in normalized_artists.items():
-            sorted_artists = sorted(value, key=self.__english_sort_key)
-            normalized_artists[key] = sorted_artists[0]
+    def __known_artists(self, artists):
+        # Artists are mapped by identity, so stored aliases are matched up
+        # with this run's Artist objects by name.
+        for artist in artists:
+            if artist not in self.__artists and artist._name in self.__artist_names:
+                self.__artists[artist] = Artist(self.__artist_names[artist._name])
 
-        for chart in self.__list:
-            for entry in chart:
-                artists = ArtistsSet()
+    def __normalize_known(self):
+        # Like __normalize, but titles and artists that earlier runs already
+        # settled map straight to their canonical form; only new ones are
+        # fuzzy-matched, against everything known.
+        entries = [entry for chart in self.__list for entry in chart]
 
-                for artist in entry.artists:
-                    normalized_artist = normalized_artists[artist]
-                    artists.add(Artist._substitution_cache[normalized_artist] if normalized_artist
-                        in Artist._substitution_cache else normalized_artist)
+        self.__strip_titles(entries)
+        self.__canonicalize([entry.title for entry in entries], self.__titles,
+            lambda titles: sorted(sorted(titles), key=self.__english_sort_key))
 
-                entry.artists = artists
+        for entry in entries:
+            entry.title = self.__titles[entry.title]
 
-        for chart in self.__list[1:]:
-            for outer_entry in chart:
-                for inner_entry in self.__list[0]:
-                    if outer_entry.title == inner_entry.title:
-                        outer_entry.video = inner_entry.video
+        self.__reconcile_artists(entries)
+
+        artists = [artist for entry in entries for artist in entry.artists]
+
+        self.__known_artists(artists)
+        self.__canonicalize(artists, self.__artists, lambda artists: sorted(artists, key=self.__english_sort_key))
+
+        self.__apply_artists(entries, self.__artists)
+        self.__propagate_videos(self.__list[1:])
+
+    def __canonicalize(self, keys, known, sort):
+        # Maps keys not seen by the last pass onto the canonical value of a
+        # similar known key, or else onto the best of the similar new keys.
+        new_keys = list(collections.OrderedDict.fromkeys(key for key in keys if key not in known))
+        similar = self.__similar_index(list(known) + new_keys, new_keys)
+        canonical = dict()
+
+        for key in new_keys:
+            known_values = [known[other] for other in similar[key] if other in known]
+
+            if known_values:
+                canonical[key] = sort(known_values)[0]
+            else:
+                canonical[key] = sort(set(similar[key]) | {key})[0]
+
+        known.update(canonical)
+
+    def __normalize_chart(self, chart):
+        # Incremental pass: only the new chart is matched against the titles
+        # and artists the previous passes already settled on.
+        position = next(i for i, other in enumerate(self.__list) if other is chart)
+        chart_entries = list(chart)
+        entries = [entry for other in self.__list[:position] for entry in other] + chart_entries
+        new_entries = set(id(entry) for entry in chart_entries)
+
+        self.__strip_titles(chart_entries)
+        self.__canonicalize([entry.title for entry in chart_entries], self.__titles,
+            lambda titles: sorted(sorted(titles), key=self.__english_sort_key))
+
+        for entry in chart_entries:
+            entry.title = self.__titles[entry.title]
+
+        touched = new_entries | self.__reconcile_artists(entries, new_entries)
+
+        # A substitution made here can give two credits of an entry settled
+        # by an earlier pass the same name.
+        touched.update(id(entry) for entry in entries if len(set(map(str, entry.artists))) < len(entry.artists))
+        touched = [entry for entry in entries if id(entry) in touched]
+
+        self.__known_artists(artist for entry in touched for artist in entry.artists)
+        self.__canonicalize([artist for entry in touched for artist in entry.artists], self.__artists,
+            lambda artists: sorted(artists, key=self.__english_sort_key))
+
+        self.__apply_artists(touched, self.__artists)
+        self.__propagate_videos([chart])
 
 class IChart(Chart):
     _cls_regex = re.compile('^ichart_score([0-9]*)_song1$')
     _artist_regex = re.compile('^ichart_score([0-9]*)_artist1$')
     _change_regex = re.compile('^ichart_score([0-9]*)_change')
     _change_classes = dict(arrow1='up', arrow2='down', arrow3='none', arrow4='new', arrow5='new')
+    _video_workers = 8
+    _video_deadline = 30
+    _headers = { 'Referer'    : 'http://ichart.instiz.net/',
+                 'User-Agent' : 'Mozilla/5.0 (X11; Linux x86_64; rv:44.0) Gecko/20100101 Firefox/44.0' }
 
     @property
     def name(self):
@@ -323,17 +840,12 @@ class IChart(Chart):
 
         return urls[self.chart_type]
 
-    def _fetch_chart(self):
-        req = urllib.request.Request(self.url)
-        req.add_header('Referer', 'http://ichart.instiz.net/')
-        req.add_header('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64; rv:44.0) Gecko/20100101 Firefox/44.0')
-        page = urllib.request.urlopen(req, data=None, timeout=15)
-
-        root = lxml.html.parse(page)
-
+    def _parse_chart(self, root):
         rank = 1
         entry = None
 
+        # Walked lazily rather than matched up front, so parsing stops at
+        # the row after limit instead of covering the whole page.
         for element in root.iter(tag=lxml.etree.Element):
             cls = element.get('class')
 
@@ -367,7 +879,7 @@ class IChart(Chart):
                 if opar != -1 and cpar == -1 or cpar < opar:
                     title = title[:opar]
 
-                entry.title = ftfy.fix_encoding(title.strip())
+                entry.title = _fix_encoding(title.strip())
 
             if self._artist_regex.match(cls):
                 for artist in element.text_content().replace(' & ', ',').split(','):
@@ -376,15 +888,12 @@ class IChart(Chart):
             if cls == 'ichart_mv' and len(element):
                 entry.video = 'https://youtu.be/' + element[0].get('href').split(',')[1][1:-2]
 
-        for entry in self:
-            if not entry.video:
-                try:
-                    artists = '{0} - {1}'.format(str(entry.artists), entry.title)
-                    entry.video = youtube.Video(artists).url
-                except youtube.YouTubeError:
-                    pass
+    def _complete_chart(self):
+        resolve_videos(self, max_workers=self._video_workers, deadline=self._video_deadline)
 
 class MelonChart(Chart):
+    _headers = { 'User-Agent' : 'Mozilla/5.0 (X11; Linux x86_64; rv:44.0) Gecko/20100101 Firefox/44.0' }
+
     @property
     def name(self):
         return 'Melon'
@@ -403,16 +912,12 @@ class MelonChart(Chart):
 
         return urls[self.chart_type]
 
-    def _fetch_chart(self):
-        req = urllib.request.Request(self.url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64; rv:44.0) Gecko/20100101 Firefox/44.0')
-        page = urllib.request.urlopen(req, data=None, timeout=15)
-
-        root = lxml.html.parse(page)
-
+    def _parse_chart(self, root):
         rank = 1
         entry = None
 
+        # Walked lazily rather than matched up front, so parsing stops at
+        # the row after limit instead of covering the whole page.
         for element in root.iter(tag=lxml.etree.Element):
             cls = element.get('class')
 
@@ -438,7 +943,7 @@ class MelonChart(Chart):
             if cls == 'ellipsis rank01' or cls == 'ellipsis rank02' and entry is not None:
                 for a in element.iter(tag='a'):
                     if not entry.title:
-                        entry.title = ftfy.fix_encoding(a.text_content().strip())
+                        entry.title = _fix_encoding(a.text_content().strip())
                     else:
                         for artist in a.text_content().split('|')[0].replace(' & ', ',').split(','):
                             entry.artists.append(Artist(artist.strip()))
@@ -464,15 +969,12 @@ class GaonChart(Chart):
 
         return urls[self.chart_type]
 
-    def _fetch_chart(self):
-        req = urllib.request.Request(self.url)
-        page = urllib.request.urlopen(req, data=None, timeout=15)
-
-        root = lxml.html.parse(page)
-
+    def _parse_chart(self, root):
         rank = 1
         entry = None
 
+        # Walked lazily rather than matched up front, so parsing stops at
+        # the row after limit instead of covering the whole page.
         for element in root.iter(tag=lxml.etree.Element):
             cls = element.get('class')
 
@@ -501,11 +1003,126 @@ class GaonChart(Chart):
                     entry.change_diff = change_diff
 
             if cls == 'subject':
-                entry.title = ftfy.fix_encoding(element[0].text_content().strip())
+                entry.title = _fix_encoding(element[0].text_content().strip())
 
                 for artist in element[1].text_content().split('|')[0].replace(' & ', ',').split(','):
                     entry.artists.append(Artist(artist.strip()))
 
+ChartSpec = collections.namedtuple('ChartSpec', ['chart', 'chart_type', 'limit', 'budget'])
+ChartSpec.__new__.__defaults__ = (None, 50, None)
+
+class FetchedCharts(list):
+    def __init__(self):
+        super(FetchedCharts, self).__init__()
+        self.errors = list()
+
+# Stands in for a chart that couldn't be fetched, so the remaining columns
+# of a table keep their place.
+class UnavailableChart(list):
+    def __init__(self, spec, error):
+        super(UnavailableChart, self).__init__()
+        chart = spec.chart.__new__(spec.chart)
+
+        self.name = chart.name
+        self.chart_type = spec.chart_type if spec.chart_type is not None else chart._default_chart_type
+        self.limit = spec.limit
+        self.url = ''
+        self.error = error
+
+def _chart_spec(spec):
+    if isinstance(spec, ChartSpec):
+        return spec
+
+    if isinstance(spec, type):
+        return ChartSpec(spec)
+
+    return ChartSpec(*spec)
+
+def _build_chart(spec, run_deadline, retries, hedge):
+    # A source gets its own budget from when it starts, but never more than
+    # what's left of the whole run.
+    budgets = [spec.budget] if spec.budget is not None else list()
+
+    if run_deadline is not None:
+        budgets.append(run_deadline - time.monotonic())
+
+    return spec.chart(chart_type=spec.chart_type, limit=spec.limit, timeout=min(budgets) if budgets else None,
+        retries=retries, hedge=hedge)
+
+def fetch_charts(specs, max_workers=4, deadline=None, retries=0, hedge=None, placeholders=False):
+    specs = [_chart_spec(spec) for spec in specs]
+    charts = FetchedCharts()
+
+    if not specs:
+        return charts
+
+    run_deadline = _deadline(deadline)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(specs)))
+    futures = [_submit(executor, _build_chart, spec, run_deadline, retries, hedge) for spec in specs]
+
+    try:
+        concurrent.futures.wait(futures, timeout=deadline)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for spec, future in zip(specs, futures):
+        if future.done() and not future.cancelled():
+            try:
+                charts.append(future.result())
+                continue
+            except ChartError as e:
+                error = e
+        else:
+            error = ChartFetchError('Timed out fetching {0} chart.'.format(spec.chart.__new__(spec.chart).name))
+
+        charts.errors.append((spec, error))
+        metrics.count('chart_fetch_errors', chart=spec.chart.__name__)
+
+        if placeholders:
+            charts.append(UnavailableChart(spec, error))
+
+    return charts
+
+def _entry_rank(entry):
+    try:
+        return int(entry.rank)
+    except (TypeError, ValueError):
+        return float('inf')
+
+def _find_video(entry):
+    try:
+        return youtube.Video('{0} - {1}'.format(str(entry.artists), entry.title)).url
+    except youtube.YouTubeError:
+        return ''
+
+def resolve_videos(entries, max_workers=8, deadline=None):
+    pending = sorted((entry for entry in entries if not entry.video), key=_entry_rank)
+    resolved = 0
+
+    if not pending:
+        return resolved
+
+    # Lookups are submitted in rank order so the top of the chart is
+    # resolved first; whatever hasn't finished by the deadline stays empty.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(pending)))
+    futures = dict((_submit(executor, _find_video, entry), entry) for entry in pending)
+
+    try:
+        with metrics.timer('resolve_videos'):
+            for future in concurrent.futures.as_completed(futures, timeout=deadline):
+                if future.exception() is None and future.result():
+                    futures[future].video = future.result()
+                    resolved += 1
+    except concurrent.futures.TimeoutError:
+        metrics.count('video_deadline_exceeded')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    metrics.count('videos_resolved', resolved)
+
+    return resolved
+
 class RedditChartsTable:
     def __init__(self, charts, columns=None, limit=20):
         self._charts = charts
@@ -538,7 +1155,8 @@ class RedditChartsTable:
         table = list()
 
         if not self._header:
-            columns = ['*{0} Top {1}*'.format(chart.name, self.limit) for chart in self._charts[0:self._columns]]
+            columns = ['*{0} Top {1}*{2}'.format(chart.name, self.limit,
+                ' (unavailable)' if isinstance(chart, UnavailableChart) else '') for chart in self._charts[0:self._columns]]
             columns.insert(0, '')
             self._header = ' | '.join(columns)
 
@@ -551,10 +1169,19 @@ class RedditChartsTable:
         table.append('|'.join(cont))
 
         for i in range(self.limit):
-            entries = [chart[i] for chart in self._charts[0:self._columns]]
+            cells = list()
+
+            # Charts that came back short (or not at all) leave a gap rather
+            # than failing the whole table.
+            for chart in self._charts[0:self._columns]:
+                if i < len(chart):
+                    entry = chart[i]
+                    cells.append('{0} {1}'.format(self._make_link(entry.video,
+                        '{0} - {1}'.format(str(entry.artists), entry.title)),
+                        self._make_change(entry.change, entry.change_diff)))
+                else:
+                    cells.append('–')
 
-            table.append('{0}. | {1}'.format(i + 1, ' | '.join('{0} {1}'.format(self._make_link(entry.video,
-                '{0} - {1}'.format(str(entry.artists), entry.title)),
-                self._make_change(entry.change, entry.change_diff)) for entry in entries)))
+            table.append('{0}. | {1}'.format(i + 1, ' | '.join(cells)))
 
         return '\n'.join(table)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import collections
+import contextlib
+import cProfile
+import json
+import threading
+import time
+
+Timing = collections.namedtuple('Timing', ['count', 'total', 'max'])
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _label_text(labels, quote=''):
+    if not labels:
+        return ''
+
+    return '{{{0}}}'.format(','.join('{0}={1}{2}{1}'.format(label, quote, value) for label, value in labels))
+
+class Registry():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._timings = dict()
+        self.exporters = list()
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+
+        with self._lock:
+            count, total, longest = self._timings.get(key, (0, 0.0, 0.0))
+            self._timings[key] = Timing(count + 1, total + seconds, max(longest, seconds))
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def timings(self):
+        with self._lock:
+            return dict(self._timings)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+    def export(self, **fields):
+        for exporter in self.exporters:
+            exporter(self, **fields)
+
+registry = Registry()
+
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+
+class JsonLinesExporter():
+    # Appends one JSON object per export, e.g. one per sidebar update.
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, registry, **fields):
+        line = dict(fields)
+        line['time'] = time.time()
+        line['counters'] = dict((name + _label_text(labels), value)
+            for (name, labels), value in sorted(registry.counters().items()))
+        line['timers'] = dict((name + _label_text(labels), timing._asdict())
+            for (name, labels), timing in sorted(registry.timings().items()))
+
+        with open(self.path, 'a') as metrics_file:
+            metrics_file.write(json.dumps(line, sort_keys=True) + '\n')
+
+def prometheus(registry=registry, prefix='kpopcharts_'):
+    lines = list()
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+    for (name, labels), value in sorted(registry.counters().items()):
+        name = prefix + name + '_total'
+        declare(name, 'counter')
+        lines.append('{0}{1} {2}'.format(name, _label_text(labels, '"'), value))
+
+    for (name, labels), timing in sorted(registry.timings().items()):
+        name = prefix + name + '_seconds'
+        declare(name, 'summary')
+        lines.append('{0}_count{1} {2}'.format(name, _label_text(labels, '"'), timing.count))
+        lines.append('{0}_sum{1} {2!r}'.format(name, _label_text(labels, '"'), timing.total))
+
+    return '\n'.join(lines) + '\n'
+
+@contextlib.contextmanager
+def profile(path):
+    # Dumps a cProfile of the block to path (for pstats or snakeviz); a no-op
+    # when path is empty.
+    if not path:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
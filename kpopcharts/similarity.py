@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import bisect
+import collections
+import difflib
+import functools
+import itertools
+import math
+
+# our stuff
+from . import metrics
+from ._lru import LRUCache
+
+def _grams(text):
+    # Each bigram is numbered by occurrence, so the number of grams two
+    # strings have in common counts a repeated bigram as often as both of
+    # them have it.
+    seen = collections.Counter()
+    grams = list()
+
+    for i in range(len(text) - 1):
+        gram = text[i:i + 2]
+        grams.append((gram, seen[gram]))
+        seen[gram] += 1
+
+    # Strings too short for a bigram can only match themselves above 0.8.
+    return grams or [(text, 0)]
+
+@functools.lru_cache(maxsize=None)
+def _shared(threshold, total):
+    # Fewest grams two strings of that total length can have in common and
+    # still beat the threshold. Two empty strings match without sharing
+    # anything.
+    if not total:
+        return 1
+
+    matches = int(threshold * total / 2) + 1
+
+    return max(1, 3 * matches - total - 1)
+
+def _band(threshold, length):
+    # Lengths that could still beat the threshold against this one, since
+    # ratio() can't beat 2 * shorter / (shorter + longer).
+    return length * threshold / (2 - threshold), length * (2 - threshold) / threshold
+
+@functools.lru_cache(maxsize=None)
+def _fewest(threshold, length):
+    # The least a string of that length could have in common with anything
+    # in its length band and still beat the threshold.
+    low, high = _band(threshold, length)
+
+    return min(_shared(threshold, length + other) for other in range(math.ceil(low), math.floor(high) + 1))
+
+# Finds the pairs of strings whose SequenceMatcher ratio() is above
+# threshold without comparing every string with every other.
+#
+# Candidates are blocked by length and, for thresholds of 0.8 and up, by
+# shared bigrams: M matching characters in k matching blocks share at least
+# M - k bigrams, and since blocks are separated by at least one unmatched
+# character, k <= len(a) + len(b) - 2M + 1. Past 0.8 that leaves a minimum
+# number of shared bigrams for every pair of lengths, so blocking on them
+# loses nothing. Survivors go through real_quick_ratio() and quick_ratio()
+# before the full ratio(), and pair scores are cached across calls.
+class SimilarityEngine():
+    def __init__(self, threshold=0.8, cache_size=1 << 16):
+        self.threshold = threshold
+        self._scores = LRUCache(cache_size)
+
+    def _blocker(self, others):
+        lengths = [len(text) for text in others]
+
+        if self.threshold >= 0.8:
+            grams = [_grams(text) for text in others]
+            frequency = collections.Counter(itertools.chain.from_iterable(grams))
+            rarity = lambda gram: (frequency[gram], gram)
+
+            def prefix(text, text_grams):
+                # Strings with at least n grams in common share one of each
+                # other's len(grams) - n + 1 rarest ones, so only those need
+                # indexing or looking up.
+                fewest = _fewest(self.threshold, len(text))
+
+                return sorted(text_grams, key=rarity)[:len(text_grams) - fewest + 1]
+
+            postings = collections.defaultdict(list)
+
+            for j in sorted(range(len(others)), key=lengths.__getitem__):
+                for gram in prefix(others[j], grams[j]):
+                    postings[gram].append(j)
+
+            # Postings are in length order, so the length band is a slice.
+            bands = dict((gram, [lengths[j] for j in posting]) for gram, posting in postings.items())
+            grams = [set(text_grams) for text_grams in grams]
+
+            def candidates(text):
+                text_grams = _grams(text)
+                low, high = _band(self.threshold, len(text))
+                found = set()
+
+                for gram in prefix(text, text_grams):
+                    if gram in postings:
+                        band = bands[gram]
+                        found.update(postings[gram][bisect.bisect_left(band, low):bisect.bisect_right(band, high)])
+
+                text_grams = set(text_grams)
+
+                return set(j for j in found
+                    if len(text_grams & grams[j]) >= _shared(self.threshold, len(text) + lengths[j]))
+        else:
+            order = sorted(range(len(others)), key=lengths.__getitem__)
+            keys = [lengths[j] for j in order]
+
+            def candidates(text):
+                low, high = _band(self.threshold, len(text))
+
+                return set(order[bisect.bisect_left(keys, low):bisect.bisect_right(keys, high)])
+
+        return candidates
+
+    def _score(self, matcher, a, b):
+        # matcher already has b as its second sequence; b2j is built once
+        # per string that way rather than once per pair.
+        matcher.set_seq1(a)
+        score = matcher.real_quick_ratio()
+
+        if score <= self.threshold:
+            return score
+
+        key = (a, b)
+        cached = self._scores.get(key)
+
+        if cached is not None:
+            return cached
+
+        score = matcher.quick_ratio()
+
+        if score > self.threshold:
+            score = matcher.ratio()
+
+        # Below the threshold an upper bound is as good as the real score,
+        # since all anyone asks is whether it's above.
+        self._scores[key] = score
+
+        return score
+
+    def similar(self, a, b):
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq2(b)
+
+        return self._score(matcher, a, b) > self.threshold
+
+    def index(self, keys, outer_keys=None):
+        # For each outer key, the keys similar to it (outer as the first
+        # sequence), in the order they appear in keys.
+        outer_keys = keys if outer_keys is None else outer_keys
+        outer_texts = [str(key) for key in outer_keys]
+        index = collections.OrderedDict((key, list()) for key in outer_keys)
+        candidates = self._blocker(outer_texts)
+        matcher = difflib.SequenceMatcher(None)
+        compared = 0
+
+        for inner in keys:
+            text = str(inner)
+            matcher.set_seq2(text)
+            found = candidates(text)
+            compared += len(found)
+
+            for j in found:
+                if self._score(matcher, outer_texts[j], text) > self.threshold:
+                    index[outer_keys[j]].append(inner)
+
+        metrics.count('similarity_comparisons', compared)
+
+        return index
+
+    def pairs(self, texts):
+        # Each similar pair (j, i) once, with j < i. ratio() isn't
+        # symmetric, so a pair is similar if it is either way round.
+        candidates = self._blocker(texts)
+        matcher = difflib.SequenceMatcher(None)
+        reverse = difflib.SequenceMatcher(None)
+        compared = 0
+
+        for i, text in enumerate(texts):
+            matcher.set_seq2(text)
+            found = sorted(j for j in candidates(text) if j < i)
+            compared += len(found)
+
+            for j in found:
+                if self._score(matcher, texts[j], text) > self.threshold:
+                    yield j, i
+                    continue
+
+                reverse.set_seq2(texts[j])
+
+                if self._score(reverse, text, texts[j]) > self.threshold:
+                    yield j, i
+
+        metrics.count('similarity_comparisons', compared)
+
+    def clusters(self, keys):
+        # Groups keys into the connected components of the similarity graph,
+        # each listed in the order its keys appear in keys.
+        keys = list(keys)
+        parent = list(range(len(keys)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+
+            return i
+
+        for j, i in self.pairs([str(key) for key in keys]):
+            root_j, root_i = find(j), find(i)
+
+            if root_j != root_i:
+                parent[max(root_j, root_i)] = min(root_j, root_i)
+
+        clusters = collections.OrderedDict()
+
+        for i, key in enumerate(keys):
+            clusters.setdefault(find(i), list()).append(key)
+
+        return list(clusters.values())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2015 by NewbieSone <newbiesone@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# stdlib
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+import urllib.parse
+
+# our stuff
+from . import _lazy
+from . import metrics
+
+# third-party
+requests = _lazy.load('requests')
+
+Response = collections.namedtuple('Response', ['url', 'content', 'modified'])
+
+class Transport():
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_connections=8, pool_maxsize=8, timeout=15, backoff=0.5):
+        self.timeout = timeout
+        self.backoff = backoff
+        self._pool_maxsize = pool_maxsize
+        self._hedges = None
+
+        self._session = requests.Session()
+        self._session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._validators = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+
+            return cls._shared
+
+    # deadline is a time.monotonic() value that retries and backoff never run
+    # past. With hedge set, an attempt still running after that many seconds
+    # gets a duplicate request and the first good answer wins.
+    def get(self, url, headers=None, timeout=None, retries=0, deadline=None, hedge=None):
+        attempt = 0
+
+        while True:
+            attempt_timeout = timeout if timeout is not None else self.timeout
+
+            if deadline is not None:
+                attempt_timeout = min(attempt_timeout, deadline - time.monotonic())
+
+                if attempt_timeout <= 0:
+                    raise requests.Timeout('Deadline exceeded fetching {0}'.format(url))
+
+            try:
+                if hedge is not None and hedge < attempt_timeout:
+                    return self._hedged(url, headers, attempt_timeout, hedge)
+
+                return self._request(url, headers, attempt_timeout)
+            except requests.RequestException as e:
+                if attempt >= retries or not _retryable(e):
+                    raise
+
+                # Full jitter, so sources that failed together don't retry
+                # in lockstep.
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+
+            metrics.count('http_retries')
+            time.sleep(delay)
+            attempt += 1
+
+    def _hedged(self, url, headers, timeout, hedge):
+        with self._lock:
+            if self._hedges is None:
+                self._hedges = concurrent.futures.ThreadPoolExecutor(max_workers=self._pool_maxsize)
+
+        started = time.monotonic()
+        futures = [self._hedges.submit(self._request, url, headers, timeout)]
+        done, pending = concurrent.futures.wait(futures, timeout=hedge)
+
+        if not done:
+            metrics.count('http_hedged_requests')
+            futures.append(self._hedges.submit(self._request, url, headers, timeout - (time.monotonic() - started)))
+
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is None:
+                return future.result()
+
+        return futures[0].result()
+
+    def _request(self, url, headers, timeout):
+        headers = dict(headers) if headers is not None else dict()
+
+        with self._lock:
+            cached = self._validators.get(url)
+
+        if cached is not None:
+            etag, last_modified, content = cached
+
+            if etag:
+                headers['If-None-Match'] = etag
+
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        host = urllib.parse.urlsplit(url).netloc
+
+        with metrics.timer('http_request', host=host):
+            response = self._session.get(url, headers=headers, timeout=timeout)
+
+        metrics.count('http_requests', host=host)
+
+        if response.status_code == 304 and cached is not None:
+            metrics.count('http_not_modified', host=host)
+            return Response(url, cached[2], False)
+
+        response.raise_for_status()
+
+        content = response.content
+        metrics.count('http_bytes_downloaded', len(content), host=host)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        with self._lock:
+            if etag or last_modified:
+                self._validators[url] = (etag, last_modified, content)
+            else:
+                self._validators.pop(url, None)
+
+        return Response(url, content, True)
+
+    def close(self):
+        if self._hedges is not None:
+            self._hedges.shutdown(wait=False)
+
+        self._session.close()
+
+def _retryable(e):
+    # Timeouts, dropped connections, rate limiting and server errors may go
+    # away on their own; anything else the server said won't.
+    response = getattr(e, 'response', None)
+
+    if response is None:
+        return True
+
+    return response.status_code == 429 or response.status_code >= 500
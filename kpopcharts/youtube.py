@@ -17,63 +17,222 @@
 
 # stdlib
 import contextlib
+import contextvars
 import difflib
+import sqlite3
+import threading
+import time
+
+# our stuff
+from . import _lazy
+from . import metrics
+from ._lru import LRUCache
 
 # third-party
-from apiclient.discovery import build
-from apiclient.errors import HttpError
+apiclient = _lazy.load('apiclient')
+httplib2 = _lazy.load('httplib2')
 
 class YouTubeError(Exception):
     pass
 
 class _YouTube():
     _api_key = None
+    _cache = None
+
+# The Session the current thread (or task) is running under; see
+# Session.__enter__.
+_current_session = contextvars.ContextVar('youtube_session', default=None)
+
+class Cache():
+    def __init__(self, path, positive_ttl=7 * 24 * 60 * 60, negative_ttl=24 * 60 * 60):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS videos (pattern TEXT PRIMARY KEY, url TEXT NOT NULL, time REAL NOT NULL)')
+
+    @staticmethod
+    def _key(pattern):
+        return ' '.join(pattern.casefold().split())
+
+    def get(self, pattern):
+        with self._lock:
+            row = self._db.execute('SELECT url, time FROM videos WHERE pattern = ?', (self._key(pattern),)).fetchone()
+
+        if row is None:
+            return None
+
+        url, stored = row
+        ttl = self.positive_ttl if url else self.negative_ttl
+
+        if time.time() - stored > ttl:
+            return None
+
+        return url
+
+    def set(self, pattern, url):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO videos (pattern, url, time) VALUES (?, ?, ?)',
+                (self._key(pattern), url or '', time.time()))
+
+    def purge(self):
+        now = time.time()
+
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM videos WHERE (url != '' AND time < ?) OR (url = '' AND time < ?)",
+                (now - self.positive_ttl, now - self.negative_ttl))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 class Video(_YouTube):
-    def __init__(self, pattern, api_key=None):
+    def __init__(self, pattern, api_key=None, cache=None):
         self._pattern = pattern
+        self._session = _current_session.get()
+
+        if self._session is not None:
+            self._api_key = self._session._api_key
+            self._cache = self._session._cache
 
         if api_key is not None:
             self._api_key = api_key
 
+        if cache is not None:
+            self._cache = cache
+
         if self._api_key is None:
             raise YouTubeError('No API key set.')
 
         self.url = self._find()
 
     def _find(self):
+        if self._cache is not None:
+            url = self._cache.get(self._pattern)
+
+            if url is not None:
+                metrics.count('youtube_cache_hits')
+                return url
+
+            metrics.count('youtube_cache_misses')
+
         try:
-            youtube = build('youtube', 'v3', developerKey=self._api_key)
+            with metrics.timer('youtube_search'):
+                url = self._search()
+        except Exception:
+            metrics.count('youtube_errors')
+            return ''
 
-            response = youtube.search().list(q=self._pattern, part='id,snippet', type='video',
-                safeSearch='none', regionCode='US', maxResults=10).execute()
+        if self._cache is not None:
+            self._cache.set(self._pattern, url)
 
-            for result in response.get("items", []):
-                match = None
-                snippet = result['snippet']
-                sim = difflib.SequenceMatcher(None, self._pattern, snippet['title']).ratio()
+        return url
 
-                if sim > 0.6:
-                    match = result['id']['videoId']
+    def _shared(self):
+        return self._session is not None and self._session._api_key == self._api_key
 
-                channel = youtube.channels().list(id=snippet['channelId'],
-                    part='statistics', maxResults=1).execute().get("items", [])[0]
-                subscribers = channel['statistics']['subscriberCount']
+    def _client(self):
+        if self._shared():
+            return self._session.client
 
-                if int(subscribers) > 100000 and not 'teaser' in snippet['title'].lower():
+        return apiclient.discovery.build('youtube', 'v3', developerKey=self._api_key)
+
+    def _execute(self, request):
+        if self._shared():
+            with self._session.http() as http:
+                return request.execute(http=http)
+
+        return request.execute()
+
+    def _search(self):
+        youtube = self._client()
+
+        response = self._execute(youtube.search().list(q=self._pattern, part='id,snippet', type='video',
+            safeSearch='none', regionCode='US', maxResults=10))
+        metrics.count('youtube_api_calls', method='search')
+
+        results = response.get("items", [])
+        subscribers = None
+
+        for result in results:
+            match = None
+            snippet = result['snippet']
+            sim = difflib.SequenceMatcher(None, self._pattern, snippet['title']).ratio()
+
+            if sim > 0.6:
+                match = result['id']['videoId']
+            else:
+                if subscribers is None:
+                    subscribers = _subscriber_counts(youtube, [other['snippet']['channelId'] for other in results], self._execute)
+
+                if subscribers.get(snippet['channelId'], 0) > 100000 and not 'teaser' in snippet['title'].lower():
                     match = result['id']['videoId']
 
-                return 'https://youtu.be/{0}'.format(match) if match else ''
-        except Exception:
-            return ''
+            return 'https://youtu.be/{0}'.format(match) if match else ''
+
+        return ''
+
+# Subscriber counts belong to channels, not to any one session or request,
+# so every lookup in the process shares them.
+_subscribers = LRUCache(1 << 14)
+
+def _subscriber_counts(youtube, channel_ids, execute):
+    missing = [channel_id for channel_id in set(channel_ids) if channel_id not in _subscribers]
+
+    for i in range(0, len(missing), 50):
+        response = execute(youtube.channels().list(id=','.join(missing[i:i + 50]),
+            part='statistics', maxResults=50))
+        metrics.count('youtube_api_calls', method='channels')
+
+        for channel in response.get("items", []):
+            _subscribers[channel['id']] = int(channel['statistics'].get('subscriberCount', 0))
+
+    counts = dict((channel_id, _subscribers.get(channel_id)) for channel_id in channel_ids)
+
+    return dict((channel_id, count) for channel_id, count in counts.items() if count is not None)
 
 class Session():
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None):
         self._api_key = api_key
+        self._cache = cache
+        self._client = None
+        self._https = list()
+        self._lock = threading.Lock()
+        self._tokens = threading.local()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = apiclient.discovery.build('youtube', 'v3', developerKey=self._api_key)
+
+            return self._client
+
+    @contextlib.contextmanager
+    def http(self):
+        # The client is shared, but an httplib2.Http isn't thread-safe, so
+        # each request borrows one. The pool outlives the worker threads
+        # that use it, keeping connections warm between lookups.
+        with self._lock:
+            http = self._https.pop() if self._https else httplib2.Http()
+
+        try:
+            yield http
+        finally:
+            with self._lock:
+                self._https.append(http)
 
+    # Entering a session only affects the current context, so threads
+    # serving different requests can each use their own.
     def __enter__(self):
-        self._old_api_key = _YouTube._api_key
-        _YouTube._api_key = self._api_key
+        if not hasattr(self._tokens, 'stack'):
+            self._tokens.stack = list()
+
+        self._tokens.stack.append(_current_session.set(self))
+
+        return self
 
     def __exit__(self, *args):
-        _YouTube._api_key = self._old_api_key
+        _current_session.reset(self._tokens.stack.pop())
@@ -16,15 +16,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # stdlib
+import argparse
+import collections
 import configparser
 import datetime
+import hashlib
+import json
+import os
+import random
 import re
-import sys
 import smtplib
+import time
 import traceback
 
 # our stuff
+from kpopcharts import archive
+from kpopcharts import knowledge
 from kpopcharts import kpopcharts
+from kpopcharts import metrics
 from kpopcharts import youtube
 
 # third-party
@@ -32,7 +41,16 @@ import praw
 import requests
 import requests.auth
 
-def error(text):
+version = '0.1'
+user_agent = 'linux:org.rkpop.sidebarcharts:v{0}'.format(version)
+
+header = 'Rank | Artist - Song'
+replace_anchors = ['CHARTS_HOOK', header]
+
+class SidebarError(Exception):
+    pass
+
+def notify(text):
     message = 'From: KPop Charts Bot <{0}>\n'.format(config.get('sidebarbot', 'error_sender_address'))
     message += 'To: {0} <{1}>\n'.format(config.get('sidebarbot', 'error_recipient_name'),
         config.get('sidebarbot', 'error_recipient_address'))
@@ -47,88 +65,297 @@ def error(text):
     except (smtplib.SMTPException, ConnectionRefusedError):
         pass
 
-    sys.exit()
+def load_state(path):
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return dict()
 
-if __name__ == '__main__':
-    config = configparser.RawConfigParser()
-    config.read('config.ini')
+def save_state(path, state):
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
 
-    version = '0.1'
-    user_agent = 'linux:org.rkpop.sidebarcharts:v{0}'.format(version)
+    os.replace(path + '.tmp', path)
 
-    header = 'Rank | Artist - Song'
-    replace_anchors = ['CHARTS_HOOK', header]
+class TokenManager():
+    def __init__(self, path, auth, headers, credentials, margin=120):
+        self._path = path
+        self._auth = auth
+        self._headers = headers
+        self._credentials = credentials
+        self._margin = margin
+        self._token = load_state(path)
 
-    try:
+    def token(self):
+        if self._token.get('expires', 0) - self._margin <= time.time():
+            self.refresh()
+
+        return self._token['access_token']
+
+    def refresh(self):
+        metrics.count('reddit_token_refreshes')
+
+        response = requests.post("https://www.reddit.com/api/v1/access_token",
+            auth=self._auth, headers=self._headers, data=self._credentials)
+        token = response.json()
+
+        self._token = dict(access_token=token['access_token'], expires=time.time() + token.get('expires_in', 3600))
+
+        # Only the bot itself should be able to read the token.
+        descriptor = os.open(self._path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        with os.fdopen(descriptor, 'w') as token_file:
+            json.dump(self._token, token_file)
+
+        os.replace(self._path + '.tmp', self._path)
+
+    def call(self, function):
+        try:
+            return function(self.token())
+        except Exception as e:
+            if not unauthorized(e):
+                raise
+
+        self.refresh()
+
+        return function(self.token())
+
+def unauthorized(e):
+    if isinstance(e, praw.errors.OAuthInvalidToken):
+        return True
+
+    response = getattr(e, '_raw', None)
+
+    return getattr(response, 'status_code', None) == 401
+
+def push_sidebar(reddit, access_token, subreddit, sidebar):
+    reddit.set_access_credentials({'modconfig'}, access_token)
+
+    sub = reddit.get_subreddit(subreddit)
+
+    settings = sub.get_settings()
+
+    replaced = False
+
+    for anchor in replace_anchors:
+        escaped = re.escape(anchor)
+        pattern = re.compile('{0}.*?\n\n'.format(escaped), flags=re.DOTALL)
+        results = pattern.search(settings['description'])
+
+        if results is not None:
+            sidebar = pattern.sub(sidebar, settings['description'], 1)
+            replaced = True
+            break
+
+    if len(sidebar) > 10240:
+        raise SidebarError('Sidebar too long!')
+
+    if not replaced:
+        raise SidebarError("No anchors found in sidebar.")
+
+    update = dict(description=sidebar)
+    settings.update(update)
+    del settings['subreddit_id']
+    sub.set_settings(**settings)
+
+def _duration(seconds):
+    minutes = int(seconds // 60)
+
+    if minutes and not minutes % 60:
+        return '{0}h'.format(minutes // 60)
+
+    return '{0}m'.format(minutes)
+
+class SidebarUpdater():
+    sources = [('ichart', kpopcharts.IChart), ('melon', kpopcharts.MelonChart), ('gaon', kpopcharts.GaonChart)]
+    columns = 1
+    retry_delay = 60
+
+    def __init__(self, config):
+        self.config = config
+        self.rows = config.getint('sidebarbot', 'rows')
+        self.jitter = config.getint('sidebarbot', 'jitter')
+        self.intervals = dict((name, config.getint('sidebarbot', name + '_interval') * 60) for name, chart in self.sources)
+
+        # Everything below lives as long as the updater does, so a daemon
+        # keeps its charts, caches and connections warm between runs.
+        self.charts = dict()
+        self.due = dict((name, 0) for name, chart in self.sources)
+
+        self.videos = youtube.Session(config.get('youtube', 'api_key'),
+            cache=youtube.Cache(config.get('youtube', 'cache'),
+                positive_ttl=config.getint('youtube', 'positive_ttl'),
+                negative_ttl=config.getint('youtube', 'negative_ttl')))
+
+        self.knowledge = None
+
+        if config.get('knowledge', 'path'):
+            self.knowledge = knowledge.KnowledgeBase(config.get('knowledge', 'path'))
+
+        self.snapshots = None
+
+        if config.get('sidebarbot', 'archive'):
+            self.snapshots = archive.SnapshotArchive(config.get('sidebarbot', 'archive'))
+
+        self.tokens = TokenManager(config.get('sidebarbot', 'token'),
+            requests.auth.HTTPBasicAuth(config.get('sidebarbot', 'oauth_app_id'),
+                config.get('sidebarbot', 'oauth_app_secret')),
+            {'User-Agent': user_agent},
+            {"grant_type": "password",
+             "username": config.get('sidebarbot', 'username'),
+             "password": config.get('sidebarbot', 'password'),
+             "scope": "modconfig",
+             "duration": "temporary"})
+
+        self.reddit = praw.Reddit(user_agent=user_agent, decode_html_entities='yes')
+        self.reddit.set_oauth_app_info(config.get('sidebarbot', 'oauth_app_id'),
+            config.get('sidebarbot', 'oauth_app_secret'),
+            'http://www.example.com/unused/redirect/uri')
+
+    def fetch(self, now):
+        due = [(name, chart) for name, chart in self.sources if self.due[name] <= now]
+        fetched = kpopcharts.fetch_charts([chart for name, chart in due],
+            deadline=self.config.getint('sidebarbot', 'fetch_deadline'),
+            retries=self.config.getint('sidebarbot', 'fetch_retries'),
+            hedge=self.config.getfloat('sidebarbot', 'fetch_hedge') or None)
+        failed = set(spec.chart for spec, e in fetched.errors)
+        charts = iter(fetched)
+        fresh = list()
+
+        for name, chart in due:
+            if chart in failed:
+                self.due[name] = now + min(self.retry_delay, self.intervals[name])
+            else:
+                self.charts[name] = next(charts)
+                self.due[name] = now + self.intervals[name] + random.uniform(0, self.jitter)
+                fresh.append(name)
+
+        return fresh, fetched.errors
+
+    def schedule(self):
+        # How often the rendered columns are refreshed, e.g. '^Every ^30m',
+        # or '^ichart ^30m ^• ^gaon ^6h' when they differ.
+        shown = [name for name, chart in self.sources[:self.columns]]
+        intervals = collections.OrderedDict((name, _duration(self.intervals[name])) for name in shown)
+
+        if len(set(intervals.values())) == 1:
+            return '^Every ^{0}'.format(next(iter(intervals.values())))
+
+        return ' ^• '.join('^{0} ^{1}'.format(name, interval) for name, interval in intervals.items())
+
+    def archive(self, fresh, charts):
+        now = datetime.datetime.utcnow()
+
+        for (name, chart_class), chart in zip(self.sources, charts):
+            if name not in fresh or isinstance(chart, kpopcharts.UnavailableChart):
+                continue
+
+            # The archive is a side feature; losing a snapshot mustn't cost
+            # the sidebar its update.
+            try:
+                self.snapshots.append(chart, now)
+            except Exception:
+                metrics.count('archive_errors', source=name)
+                notify('Archiving the {0} chart failed:\n{1}'.format(name, traceback.format_exc()))
+
+    def run(self):
+        fresh, errors = self.fetch(time.time())
+        errors = dict((spec.chart, e) for spec, e in errors)
         charts = list()
-        charts.append(kpopcharts.IChart())
-        charts.append(kpopcharts.MelonChart())
-        charts.append(kpopcharts.GaonChart())
 
-        normalized = kpopcharts.NormalizedChartList(*charts)
+        # Sources that failed this time fall back to the last chart they
+        # gave us. Ones that never worked are left out, and only if none of
+        # the rendered columns are left is the update given up on.
+        for name, chart_class in self.sources:
+            if name in self.charts:
+                charts.append(self.charts[name].copy())
+            else:
+                charts.append(kpopcharts.UnavailableChart(kpopcharts.ChartSpec(chart_class), errors.get(chart_class)))
+
+        if all(isinstance(chart, kpopcharts.UnavailableChart) for chart in charts[:self.columns]):
+            # A daemon can get here with no errors this run: the sources
+            # failed earlier and just aren't due again yet.
+            reasons = [str(e) for e in errors.values()]
+            reasons.extend('{0} chart unavailable'.format(name) for name, chart_class
+                in self.sources[:self.columns] if chart_class not in errors)
+
+            raise SidebarError('\n'.join(reasons))
 
-        numrows = config.getint('sidebarbot', 'rows')
+        normalized = kpopcharts.NormalizedChartList(*charts, knowledge=self.knowledge)
 
-        with youtube.Session(config.get('youtube', 'api_key')):
-            for entry in normalized[0][:numrows]:
-                if not entry.video:
-                    artists = '{0} - {1}'.format(str(entry.artists), entry.title)
-                    entry.video = youtube.Video(artists).url
+        with self.videos:
+            kpopcharts.resolve_videos(normalized[0][:self.rows],
+                max_workers=self.config.getint('youtube', 'workers'),
+                deadline=self.config.getint('youtube', 'deadline'))
 
-        sidebar = kpopcharts.RedditChartsTable(normalized, columns=1, limit=numrows)
+        if self.snapshots is not None:
+            self.archive(fresh, normalized)
+
+        sidebar = kpopcharts.RedditChartsTable(normalized, columns=self.columns, limit=self.rows)
         sidebar._header = header
         sidebar = str(sidebar)
 
+        # Skip the Reddit round trips if the table is what we pushed last
+        # time, unless the timestamp line is due for a refresh.
+        digest = hashlib.sha256(sidebar.encode('utf-8')).hexdigest()
+        state = load_state(self.config.get('sidebarbot', 'state'))
+        force_refresh = self.config.getint('sidebarbot', 'force_refresh') * 60
+
+        if state.get('digest') == digest and (not force_refresh or time.time() - state.get('pushed', 0) < force_refresh):
+            return
+
         # FIXME TODO: Fix messy date mangling.
-        sidebar += '\n^Every ^30m ^• ^Last: ^{0} ^UTC\n\n'.format(str(datetime.datetime.utcnow()).split('.', 1)[0].rsplit(':', 1)[0].replace(' ',' ^'))
-
-        client_auth = requests.auth.HTTPBasicAuth(config.get('sidebarbot', 'oauth_app_id'),
-            config.get('sidebarbot', 'oauth_app_secret'))
-        headers = {'User-Agent': user_agent}
-        post_data = {"grant_type": "password",
-            "username": config.get('sidebarbot', 'username'),
-            "password": config.get('sidebarbot', 'password'),
-            "scope": "modconfig",
-            "duration": "temporary"}
-        response = requests.post("https://www.reddit.com/api/v1/access_token",
-            auth=client_auth, headers=headers, data=post_data)
-        access_token = response.json()['access_token']
+        sidebar += '\n{0} ^• ^Last: ^{1} ^UTC\n\n'.format(self.schedule(), str(datetime.datetime.utcnow()).split('.', 1)[0].rsplit(':', 1)[0].replace(' ',' ^'))
 
-        reddit = praw.Reddit(user_agent=user_agent, decode_html_entities='yes')
-        reddit.set_oauth_app_info(config.get('sidebarbot', 'oauth_app_id'),
-            config.get('sidebarbot', 'oauth_app_secret'),
-            'http://www.example.com/unused/redirect/uri')
-        reddit.set_access_credentials({'modconfig'}, access_token)
+        with metrics.timer('reddit_push'):
+            self.tokens.call(lambda access_token: push_sidebar(self.reddit, access_token,
+                self.config.get('sidebarbot', 'subreddit'), sidebar))
 
-        sub = reddit.get_subreddit(config.get('sidebarbot', 'subreddit'))
+        save_state(self.config.get('sidebarbot', 'state'), dict(digest=digest, pushed=time.time()))
 
-        settings = sub.get_settings()
+    def run_reporting(self, profile=None):
+        outcome = 'ok'
 
-        replaced = False
+        try:
+            with metrics.profile(profile), metrics.timer('sidebar_update'):
+                self.run()
+        except SidebarError as e:
+            outcome = 'error'
+            notify(str(e))
+        except Exception:
+            outcome = 'error'
+            notify(traceback.format_exc())
 
-        for anchor in replace_anchors:
-            escaped = re.escape(anchor)
-            pattern = re.compile('{0}.*?\n\n'.format(escaped), flags=re.DOTALL)
-            results = pattern.search(settings['description'])
+        # One line per run, so counters start over each time.
+        metrics.registry.export(outcome=outcome)
+        metrics.registry.reset()
 
-            if results is not None:
-                sidebar = pattern.sub(sidebar, settings['description'], 1)
-                replaced = True
-                break
+    def serve_forever(self, profile=None):
+        while True:
+            self.run_reporting(profile)
+            profile = None
+            time.sleep(max(0, min(self.due.values()) - time.time()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upload the realtime charts to the subreddit sidebar.')
+    parser.add_argument('--daemon', action='store_true', help='keep running and update on the configured intervals')
+    parser.add_argument('--profile', metavar='PATH', help='write a cProfile of the (first) run to PATH')
+    args = parser.parse_args()
 
-        if len(sidebar) > 10240:
-            error('Sidebar too long!')
+    config = configparser.RawConfigParser()
+    config.read('config.ini')
 
-        if replaced:
-            update = dict(description=sidebar)
-            settings.update(update)
-            del settings['subreddit_id']
-            sub.set_settings(**settings)
+    if config.get('sidebarbot', 'metrics'):
+        metrics.registry.exporters.append(metrics.JsonLinesExporter(config.get('sidebarbot', 'metrics')))
 
-            post_data = {"token_type_hint": "access_token", "token": access_token }
-            requests.post("https://www.reddit.com/api/v1/revoke_token",
-                auth=client_auth, headers=headers, data=post_data)
-        else:
-            error("No anchors found in sidebar.")
+    try:
+        updater = SidebarUpdater(config)
     except Exception:
-        error(traceback.format_exc())
+        notify(traceback.format_exc())
+        raise
+
+    if args.daemon:
+        updater.serve_forever(args.profile)
+    else:
+        updater.run_reporting(args.profile)
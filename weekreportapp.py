@@ -16,39 +16,249 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # stdlib
+import collections
 import configparser
+import gzip
+import hashlib
+import json
+import threading
+import time
 
 # our stuff
+from kpopcharts import knowledge
 from kpopcharts import kpopcharts
+from kpopcharts import metrics
 from kpopcharts import youtube
 
 # third-party
 import bottle
 
-@bottle.route('/')
-def index():
-    charts = list()
+class ReportCache():
+    def __init__(self, build, ttl, retry=60):
+        self.ttl = ttl
+        self.retry = retry
+        self._build = build
+        self._value = None
+        self._built = 0
+        self._building = False
+        self._failed = None
+        self._error = None
+        self._condition = threading.Condition()
+
+    def _backing_off(self):
+        # A build that failed less than retry seconds ago isn't tried again,
+        # so a source that's down gets hit at a bounded rate.
+        return self._failed is not None and time.monotonic() - self._failed < self.retry
+
+    def get(self):
+        with self._condition:
+            # Concurrent misses wait for the one build already in flight.
+            while self._value is None and self._building:
+                self._condition.wait()
+
+            if self._value is not None:
+                if not self._building and time.monotonic() - self._built > self.ttl and not self._backing_off():
+                    self._building = True
+                    threading.Thread(target=self._refresh, daemon=True).start()
+
+                return self._value
+
+            if self._backing_off():
+                raise self._error
+
+            self._building = True
+
+        return self._refresh(stale=False)
+
+    def _refresh(self, stale=True):
+        try:
+            value = self._build()
+        except Exception as e:
+            with self._condition:
+                self._building = False
+                self._failed = time.monotonic()
+                self._error = e
+                self._condition.notify_all()
+
+            if stale:
+                return
+
+            raise
+
+        with self._condition:
+            self._value = value
+            self._built = time.monotonic()
+            self._building = False
+            self._failed = None
+            self._error = None
+            self._condition.notify_all()
 
-    with youtube.Session(config.get('youtube', 'api_key')):
-        charts.append(kpopcharts.IChart(chart_type=kpopcharts.ChartType.Week))
+        return value
 
-    charts.append(kpopcharts.MelonChart(chart_type=kpopcharts.ChartType.Week))
-    charts.append(kpopcharts.GaonChart(chart_type=kpopcharts.ChartType.Week))
-    charts.append(kpopcharts.GaonChart(chart_type=kpopcharts.ChartType.AlbumWeek))
+Report = collections.namedtuple('Report', ['html', 'bodies'])
 
-    normalized = kpopcharts.NormalizedChartList(*charts)
+# A JSON response serialized and compressed once per report build, with a
+# strong ETag for each encoding.
+class Body():
+    def __init__(self, payload):
+        self.content = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        self.gzipped = gzip.compress(self.content, mtime=0)
 
-    reddit = str(kpopcharts.RedditChartsTable(normalized))
+        digest = hashlib.sha256(self.content).hexdigest()[:32]
+        self.etag = '"{0}"'.format(digest)
+        self.gzip_etag = '"{0}-gzip"'.format(digest)
+
+def _number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def _chart_path(chart):
+    return '{0}/{1}'.format(chart.name.lower(), chart.chart_type.name.lower())
+
+def _chart_payload(chart):
+    payload = dict(name=chart.name, chart_type=chart.chart_type.name, url=chart.url,
+        available=not isinstance(chart, kpopcharts.UnavailableChart), entries=list())
+
+    if isinstance(chart, kpopcharts.UnavailableChart):
+        payload['error'] = str(chart.error)
+
+    for entry in chart:
+        payload['entries'].append(dict(rank=_number(entry.rank), title=entry.title,
+            artists=sorted(str(artist) for artist in entry.artists), video=entry.video,
+            change=entry.change, change_diff=_number(entry.change_diff)))
+
+    return payload
+
+def build_report():
+    with youtube.Session(config.get('youtube', 'api_key'), cache=video_cache):
+        charts = kpopcharts.fetch_charts([(kpopcharts.IChart, kpopcharts.ChartType.Week),
+                                          (kpopcharts.MelonChart, kpopcharts.ChartType.Week),
+                                          (kpopcharts.GaonChart, kpopcharts.ChartType.Week),
+                                          (kpopcharts.GaonChart, kpopcharts.ChartType.AlbumWeek)],
+                                         deadline=config.getint('weekreportapp', 'fetch_deadline'),
+                                         retries=config.getint('weekreportapp', 'fetch_retries'),
+                                         placeholders=True)
+
+    # The per-chart bodies are taken as fetched, before normalization
+    # rewrites the entries in place.
+    bodies = dict(('charts/' + _chart_path(chart), Body(_chart_payload(chart))) for chart in charts)
+    bodies['charts'] = Body([dict(path='/api/charts/' + _chart_path(chart), name=chart.name,
+        chart_type=chart.chart_type.name) for chart in charts])
+
+    # Each report normalizes (and renders, since artist names depend on
+    # it) in a context of its own, so concurrent builds don't see each
+    # other's artist substitutions.
+    with kpopcharts.NormalizationContext():
+        normalized = kpopcharts.NormalizedChartList(*charts, knowledge=knowledge_base)
+        reddit = str(kpopcharts.RedditChartsTable(normalized))
+        bodies['normalized'] = Body([_chart_payload(chart) for chart in normalized])
 
     reddit += '\n\nURLs used:'
 
     for chart in charts:
-        reddit += '\n' + chart.url
+        if chart.url:
+            reddit += '\n' + chart.url
+
+    if charts.errors:
+        reddit += '\n\nErrors:'
+
+        for spec, e in charts.errors:
+            reddit += '\n' + str(e)
+
+    return Report('<pre>{0}</pre>'.format(reddit), bodies)
+
+def _accepts(header, coding):
+    # Whether an Accept-Encoding header allows coding at all, going by its
+    # q-value, or that of '*' if it isn't named.
+    qualities = dict()
 
-    return '<pre>{0}</pre>'.format(reddit)
+    for item in header.split(','):
+        name, semicolon, parameters = item.partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+
+        if not name:
+            continue
+
+        for parameter in parameters.split(';'):
+            key, equals, value = parameter.partition('=')
+
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[name] = quality
+
+    return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+def serve(body):
+    gzipped = _accepts(bottle.request.headers.get('Accept-Encoding', ''), 'gzip')
+    etag = body.gzip_etag if gzipped else body.etag
+
+    bottle.response.set_header('ETag', etag)
+    bottle.response.set_header('Vary', 'Accept-Encoding')
+    bottle.response.set_header('Cache-Control', 'no-cache')
+
+    tags = [tag.strip() for tag in bottle.request.headers.get('If-None-Match', '').split(',')]
+
+    if etag in tags or '*' in tags:
+        bottle.response.status = 304
+        return b''
+
+    bottle.response.content_type = 'application/json; charset=utf-8'
+
+    if gzipped:
+        bottle.response.set_header('Content-Encoding', 'gzip')
+        return body.gzipped
+
+    return body.content
+
+@bottle.route('/')
+def index():
+    return report_cache.get().html
+
+@bottle.route('/api/charts')
+def api_charts():
+    return serve(report_cache.get().bodies['charts'])
+
+@bottle.route('/api/charts/<source>/<chart_type>')
+def api_chart(source, chart_type):
+    body = report_cache.get().bodies.get('charts/{0}/{1}'.format(source.lower(), chart_type.lower()))
+
+    if body is None:
+        bottle.abort(404, 'No such chart.')
+
+    return serve(body)
+
+@bottle.route('/api/normalized')
+def api_normalized():
+    return serve(report_cache.get().bodies['normalized'])
+
+@bottle.route('/metrics')
+def prometheus_metrics():
+    bottle.response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    return metrics.prometheus()
 
 if __name__ == '__main__':
     config = configparser.RawConfigParser()
     config.read('config.ini')
 
-    bottle.run(host=config.get('weekreportapp', 'host'), port=config.getint('weekreportapp', 'port'))
+    video_cache = youtube.Cache(config.get('youtube', 'cache'),
+        positive_ttl=config.getint('youtube', 'positive_ttl'),
+        negative_ttl=config.getint('youtube', 'negative_ttl'))
+
+    knowledge_base = None
+
+    if config.get('knowledge', 'path'):
+        knowledge_base = knowledge.KnowledgeBase(config.get('knowledge', 'path'))
+
+    report_cache = ReportCache(build_report, config.getint('weekreportapp', 'cache_ttl'),
+        retry=config.getint('weekreportapp', 'retry'))
+
+    bottle.run(server=config.get('weekreportapp', 'server'), host=config.get('weekreportapp', 'host'),
+        port=config.getint('weekreportapp', 'port'))